@@ -0,0 +1,209 @@
+# admission.py
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import re
+import time
+
+
+class RouteClass:
+    """Класс маршрутов со своим лимитом одновременных запросов и очередью
+
+    priority: чем меньше число, тем раньше ожидающий запрос получит
+    освободившееся место в общем лимите.
+    """
+
+    def __init__(self, name: str, limit: int, queue: int = 0, priority: int = 0,
+                 max_wait: float = 1.0, shared: bool = True):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.priority = priority
+        self.max_wait = max_wait
+        # Долгие потоки (SSE) не занимают места в общем лимите
+        self.shared = shared
+        self.active = 0
+        self.waiting = 0
+        # Метрики
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_waiting = 0
+        self.wait_total = 0.0
+        self.service_time = 0.0
+
+    def record_service(self, duration: float):
+        # Скользящее среднее времени обработки для оценки Retry-After
+        self.service_time = duration if not self.service_time else self.service_time * 0.9 + duration * 0.1
+
+    def retry_after(self) -> int:
+        backlog = (self.waiting + 1) / max(self.limit, 1)
+        return max(1, math.ceil(self.service_time * backlog))
+
+    def metrics(self) -> dict:
+        return {
+            'limit': self.limit,
+            'queue': self.queue,
+            'priority': self.priority,
+            'active': self.active,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'max_waiting': self.max_waiting,
+            'avg_wait_ms': round(self.wait_total / self.admitted * 1000, 2) if self.admitted else 0.0,
+            'avg_service_ms': round(self.service_time * 1000, 2),
+        }
+
+
+class AdmissionController:
+    """Лимиты по классам маршрутов, очереди с приоритетами и метрики
+
+    routes - список (методы или None, регулярное выражение пути, имя класса
+    или None); первое совпадение определяет класс, None - запрос проходит без
+    ограничений. Запросы без совпадения попадают в default. total - общий
+    лимит на все классы с shared=True (порядка размера пула потоков).
+    Состояние не защищено блокировками: им пользуется только цикл событий.
+    """
+
+    def __init__(self, classes, routes, default: str, total: int = 40):
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.routes = [(methods, re.compile(pattern), name) for methods, pattern, name in routes]
+        self.default = default
+        self.total = total
+        self.active = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    def classify(self, method: str, path: str):
+        for methods, pattern, name in self.routes:
+            if (methods is None or method in methods) and pattern.fullmatch(path):
+                return self.classes[name] if name else None
+        return self.classes[self.default]
+
+    def metrics(self) -> dict:
+        return {
+            'total': self.total,
+            'active': self.active,
+            'classes': {name: route_class.metrics() for name, route_class in self.classes.items()},
+        }
+
+    def _can_start(self, route_class) -> bool:
+        if route_class.active >= route_class.limit:
+            return False
+        return not route_class.shared or self.active < self.total
+
+    def _start(self, route_class):
+        route_class.active += 1
+        route_class.admitted += 1
+        if route_class.shared:
+            self.active += 1
+
+    async def acquire(self, route_class) -> bool:
+        # Без очереди впереди запрос проходит сразу
+        if self._can_start(route_class) and not route_class.waiting:
+            self._start(route_class)
+            return True
+        if route_class.waiting >= route_class.queue:
+            route_class.rejected += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [route_class.priority, next(self._sequence), route_class, future]
+        heapq.heappush(self._waiters, entry)
+        route_class.waiting += 1
+        route_class.max_waiting = max(route_class.max_waiting, route_class.waiting)
+        waited = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), route_class.max_wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                # Запрос снимается с очереди; запись в куче удалится при разборе
+                future.cancel()
+                route_class.waiting -= 1
+                route_class.timed_out += 1
+                return False
+        except asyncio.CancelledError:
+            # Клиент ушел, пока ждал; если место уже выдано, возвращаем его
+            if future.done() and not future.cancelled():
+                self.release(route_class)
+            elif not future.done():
+                future.cancel()
+                route_class.waiting -= 1
+            raise
+        route_class.wait_total += time.monotonic() - waited
+        return True
+
+    def release(self, route_class):
+        route_class.active -= 1
+        if route_class.shared:
+            self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Отдает освободившиеся места ожидающим, начиная с высшего приоритета"""
+        skipped = []
+        while self._waiters:
+            entry = heapq.heappop(self._waiters)
+            _, _, route_class, future = entry
+            if future.done():
+                continue
+            if self._can_start(route_class):
+                route_class.waiting -= 1
+                self._start(route_class)
+                future.set_result(True)
+            else:
+                # Класс уперся в свой лимит - место может достаться следующему классу
+                skipped.append(entry)
+                if route_class.shared and self.active >= self.total:
+                    break
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware, пропускающий запросы через AdmissionController
+
+    Переполненный класс сразу получает 503 с Retry-After, не дожидаясь пула потоков.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        route_class = self.controller.classify(scope['method'], scope['path'])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire(route_class):
+            await self._reject(route_class, send)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.record_service(time.monotonic() - started)
+            self.controller.release(route_class)
+
+    async def _reject(self, route_class, send):
+        body = json.dumps({'detail': 'Сервер перегружен, повторите запрос позже'},
+                          ensure_ascii=False).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(route_class.retry_after()).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,80 @@
+# bench_compression.py
+"""Сравнение экономии места и затрат CPU при сжатии текстов заметок
+
+Запуск: python benchmarks/bench_compression.py [количество заметок]
+Тексты синтетические: слова из небольшого словаря, как в обычных заметках.
+Для каждого формата выводится доля заметок выше порога, итоговый размер
+и время сжатия (запись) и распаковки (чтение полной заметки) на заметку.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import ContentCodec, zstandard  # noqa: E402
+
+WORDS = ('заметка', 'список', 'покупки', 'встреча', 'завтра', 'проект', 'задача', 'отчет',
+         'позвонить', 'купить', 'молоко', 'хлеб', 'срочно', 'идея', 'todo', 'http://example.com',
+         'важно', 'сделать', 'проверить', 'почту', 'и', 'в', 'на', 'не', 'с', 'по')
+
+
+def make_notes(count: int, seed: int = 1):
+    rnd = random.Random(seed)
+    notes = []
+    for _ in range(count):
+        # Большинство заметок короткие, немногие - длинные
+        words = int(rnd.paretovariate(1.2) * 40)
+        lines = []
+        while words > 0:
+            n = min(words, rnd.randint(5, 15))
+            lines.append(' '.join(rnd.choice(WORDS) for _ in range(n)))
+            words -= n
+        notes.append('\n'.join(lines))
+    return notes
+
+
+def measure(label: str, codec: ContentCodec, notes):
+    raw_total = stored_total = packed_count = 0
+    pack_times, unpack_times = [], []
+    for text in notes:
+        raw = len(text.encode('utf-8'))
+        started = time.perf_counter()
+        data = codec.pack(text)
+        pack_times.append(time.perf_counter() - started)
+        raw_total += raw
+        if data is None:
+            stored_total += raw
+            continue
+        packed_count += 1
+        stored_total += len(data)
+        started = time.perf_counter()
+        codec.unpack(data)
+        unpack_times.append(time.perf_counter() - started)
+
+    unpack = statistics.mean(unpack_times) * 1_000_000 if unpack_times else 0.0
+    print(f"{label:<14} сжато {packed_count:6d}   {stored_total / 1024:9.0f} КБ "
+          f"({stored_total / raw_total:6.1%})   запись {statistics.mean(pack_times) * 1_000_000:7.1f} мкс"
+          f"   чтение сжатой {unpack:7.1f} мкс")
+
+
+def main(count: int):
+    notes = make_notes(count)
+    raw_total = sum(len(text.encode('utf-8')) for text in notes)
+    print(f"{count} заметок, {raw_total / 1024:.0f} КБ без сжатия")
+
+    for threshold in (1024, 4096):
+        print(f"\nПорог {threshold} байт")
+        measure('zlib-1', ContentCodec(threshold, 'zlib', 1), notes)
+        measure('zlib-6', ContentCodec(threshold, 'zlib', 6), notes)
+        if zstandard is not None:
+            measure('zstd-3', ContentCodec(threshold, 'zstd', 3), notes)
+            measure('zstd-9', ContentCodec(threshold, 'zstd', 9), notes)
+    if zstandard is None:
+        print("\nПакет zstandard не установлен, zstd пропущен")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
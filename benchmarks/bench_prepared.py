@@ -0,0 +1,74 @@
+# bench_prepared.py
+"""Сравнение времени запроса с кэшем подготовленных запросов и без него
+
+Запуск: python benchmarks/bench_prepared.py email@site.com [повторений]
+Нужна работающая база из database.py. В user_activity добавляются строки
+с типом 'benchmark', после замера они удаляются.
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db  # noqa: E402
+from db_operations import get_user_by_email, get_user_notes, log_user_activity  # noqa: E402
+
+
+def timed(func, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    return statistics.median(samples)
+
+
+def run(label: str, prepared: bool, email: str, user_id: int, repeat: int):
+    db.use_prepared_statements = prepared
+    db.close_connection()
+    db.get_connection()
+
+    # Прогрев: соединение и, для подготовленных запросов, PREPARE
+    get_user_notes(email)
+    log_user_activity(user_id, 'benchmark', 'прогрев')
+
+    notes = timed(lambda: get_user_notes(email), repeat)
+    activity = timed(lambda: log_user_activity(user_id, 'benchmark', 'замер'), repeat)
+    print(f"{label:<16} get_user_notes {notes:9.1f} мкс   log_user_activity {activity:9.1f} мкс")
+    return notes, activity
+
+
+def cleanup(user_id: int):
+    connection = db.get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("DELETE FROM user_activity WHERE user_id = %s AND activity_type = %s",
+                       (user_id, 'benchmark'))
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+def main(email: str, repeat: int):
+    user = get_user_by_email(email)
+    if not user:
+        print(f"Пользователь {email} не найден")
+        return
+
+    print(f"Медиана по {repeat} вызовам")
+    try:
+        text = run("текстовые", False, email, user['id'], repeat)
+        prepared = run("подготовленные", True, email, user['id'], repeat)
+        print(f"{'экономия':<16} get_user_notes {text[0] - prepared[0]:9.1f} мкс   "
+              f"log_user_activity {text[1] - prepared[1]:9.1f} мкс")
+    finally:
+        cleanup(user['id'])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 500)
@@ -0,0 +1,72 @@
+# bench_rows.py
+"""Сравнение памяти: строки-словари против компактных записей и ленивого чтения
+
+Запуск: python benchmarks/bench_rows.py [количество строк]
+Данные синтетические, имитируют результат запроса заметок для админ-панели.
+"""
+import os
+import sys
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import fetch_records, iter_records  # noqa: E402
+
+COLUMNS = ('id', 'title', 'content', 'created_at', 'updated_at', 'user_name', 'user_email')
+
+
+class FakeCursor:
+    """Курсор, отдающий синтетические строки так же, как mysql.connector"""
+
+    def __init__(self, count: int, dictionary: bool = False):
+        self.column_names = COLUMNS
+        self._count = count
+        self._position = 0
+        self._dictionary = dictionary
+
+    def _row(self, i: int):
+        now = datetime(2025, 1, 1)
+        row = (i, f'Заметка {i}', f'Содержание заметки номер {i}', now, now,
+               f'Пользователь {i % 100}', f'user{i % 100}@site.com')
+        return dict(zip(COLUMNS, row)) if self._dictionary else row
+
+    def fetchmany(self, size: int = 1):
+        end = min(self._position + size, self._count)
+        rows = [self._row(i) for i in range(self._position, end)]
+        self._position = end
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(self._count - self._position)
+
+    def close(self):
+        pass
+
+
+def measure(label: str, load):
+    tracemalloc.start()
+    result = load()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    print(f"{label:<28} удержано {current / 1024 / 1024:8.1f} МБ, пик {peak / 1024 / 1024:8.1f} МБ")
+
+
+def consume(iterator):
+    # Имитация рендеринга: каждая строка используется и сразу отбрасывается
+    total = 0
+    for record in iterator:
+        total += len(record.title)
+    return total
+
+
+def main(count: int):
+    print(f"Строк: {count}")
+    measure("dict (fetchall)", lambda: FakeCursor(count, dictionary=True).fetchall())
+    measure("records (fetch_records)", lambda: fetch_records(FakeCursor(count)))
+    measure("records (iter_records)", lambda: consume(iter_records(FakeCursor(count))))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,120 @@
+# bench_ttfb.py
+"""Время до первого байта: рендеринг страницы целиком против потоковой отдачи
+
+Запуск: python benchmarks/bench_ttfb.py [количество заметок]
+Рендерятся templates/index.html и templates/admin.html с синтетическим списком
+заметок, заметки отдаются лениво порциями, как iter_all_notes_admin(). Отдельно меряется
+загрузка шаблона без кэша байткода и с ним. База не нужна.
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape  # noqa: E402
+
+from fragments import FragmentCache  # noqa: E402
+from records import record_type  # noqa: E402
+from templating import coalesce, enable_bytecode_cache  # noqa: E402
+
+Note = record_type(('id', 'title', 'content', 'version', 'created_at', 'updated_at'))
+AdminNote = record_type(('id', 'title', 'content', 'created_at', 'updated_at', 'user_name', 'user_email'))
+
+
+def make_env(bytecode_dir: str = None):
+    env = Environment(loader=FileSystemLoader(os.path.join(ROOT, 'templates')),
+                      autoescape=select_autoescape())
+    if bytecode_dir:
+        enable_bytecode_cache(env, bytecode_dir)
+    env.globals['CSS_VERSION'] = '1'
+    env.globals['note_card'] = FragmentCache(env).render
+    return env
+
+
+def notes(count: int, admin: bool = False, batch: int = 500, fetch_delay: float = 0.002):
+    # Имитация чтения из базы: пауза на каждую порцию fetchmany
+    now = datetime(2025, 1, 1)
+    for i in range(count):
+        if i % batch == 0:
+            time.sleep(fetch_delay)
+        content = f'Содержание заметки номер {i} ' * 5
+        if admin:
+            yield AdminNote(i, f'Заметка {i}', content, now, now, f'Пользователь {i % 100}', f'user{i % 100}@site.com')
+        else:
+            yield Note(i, f'Заметка {i}', content, 1, now, now)
+
+
+def home_context(count: int):
+    return {'notes': notes(count), 'notes_count': count, 'page': 1, 'pages': 1,
+            'current_user': 'user@site.com', 'current_role': 'user', 'user_activity': []}
+
+
+def admin_context(count: int):
+    stats = {'total_users': 100, 'total_notes': count, 'active_today': 10, 'recent_activity': []}
+    return {'stats': stats, 'users': [], 'recent_activity': [], 'all_notes': notes(count, admin=True),
+            'current_user': 'admin@site.com', 'current_role': 'admin'}
+
+
+PAGES = (('index.html', home_context), ('admin.html', admin_context))
+
+
+def full_render(env, name: str, context):
+    started = time.perf_counter()
+    body = env.get_template(name).render(context).encode('utf-8')
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed, len(body)
+
+
+def streamed(env, name: str, context):
+    started = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in coalesce(env.get_template(name).generate(context)):
+        if first is None:
+            first = time.perf_counter() - started
+        size += len(chunk)
+    return first, time.perf_counter() - started, size
+
+
+def compile_time(bytecode_dir: str = None, repeat: int = 20):
+    samples = []
+    for _ in range(repeat):
+        env = make_env(bytecode_dir)
+        started = time.perf_counter()
+        env.get_template('index.html')
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main(count: int, repeat: int = 5):
+    bytecode_dir = tempfile.mkdtemp(prefix='bench-jinja-')
+    try:
+        make_env(bytecode_dir).get_template('index.html')
+        print(f"Загрузка index.html: без кэша байткода {compile_time():.2f} мс, "
+              f"с кэшем {compile_time(bytecode_dir):.2f} мс")
+    finally:
+        shutil.rmtree(bytecode_dir, ignore_errors=True)
+
+    env = make_env()
+    for name, context in PAGES:
+        print(f"\n{name}: {count} заметок, медиана по {repeat} запускам")
+        for label, render in (('целиком', full_render), ('потоком', streamed)):
+            # Каждый запуск с пустым кэшем карточек, как при первом открытии страницы
+            results = []
+            for _ in range(repeat):
+                env.globals['note_card'] = FragmentCache(env).render
+                results.append(render(env, name, context(count)))
+            ttfb = statistics.median(r[0] for r in results) * 1000
+            total = statistics.median(r[1] for r in results) * 1000
+            print(f"{label:<8} первый байт {ttfb:8.1f} мс   весь ответ {total:8.1f} мс   "
+                  f"{results[0][2] / 1024:.0f} КБ")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,81 @@
+# bench_typeahead.py
+"""Время поиска по префиксу и память индекса названий заметок
+
+Запуск: python benchmarks/bench_typeahead.py [количество названий]
+Названия синтетические; база не нужна, индекс строится из списка в памяти.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from typeahead import TypeaheadIndex  # noqa: E402
+
+WORDS = ('Список', 'покупки', 'Встреча', 'проект', 'Задача', 'отчет', 'Идея', 'звонок',
+         'План', 'неделя', 'Рецепт', 'книга', 'Project', 'meeting', 'Notes', 'todo')
+
+
+def make_titles(count: int, seed: int = 1):
+    rnd = random.Random(seed)
+    return [(i, f"{rnd.choice(WORDS)} {rnd.choice(WORDS).lower()} {rnd.randint(1, 10000)}")
+            for i in range(1, count + 1)]
+
+
+def percentile(samples, p: float):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def main(count: int):
+    titles = make_titles(count)
+    # Как при чтении из базы: строки названий принадлежат индексу, а не общему списку
+    index = TypeaheadIndex(lambda user_email: [(note_id, title.encode().decode()) for note_id, title in titles])
+
+    started = time.perf_counter()
+    index.search('user@site.com', 'a')
+    build = time.perf_counter() - started
+
+    # Память меряем отдельным построением: tracemalloc сильно замедляет его
+    index.clear()
+    tracemalloc.start()
+    index.search('user@site.com', 'a')
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{count} названий: построение {build * 1000:.1f} мс, "
+          f"память {memory / 1024 / 1024:.1f} МБ (оценка индекса {index.size / 1024 / 1024:.1f} МБ)")
+
+    rnd = random.Random(2)
+    prefixes = []
+    for _ in range(20000):
+        title = rnd.choice(titles)[1]
+        prefixes.append(title[:rnd.randint(1, 8)])
+
+    samples = []
+    for prefix in prefixes:
+        started = time.perf_counter()
+        index.search('user@site.com', prefix, 10)
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    print(f"поиск топ-10: медиана {statistics.median(samples):.1f} мкс, "
+          f"p99 {percentile(samples, 0.99):.1f} мкс, максимум {max(samples):.1f} мкс")
+
+    samples = []
+    for note_id in range(count + 1, count + 2001):
+        started = time.perf_counter()
+        index.note_saved('user@site.com', note_id, f"{rnd.choice(WORDS)} {note_id}")
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    print(f"добавление: медиана {statistics.median(samples):.1f} мкс, p99 {percentile(samples, 0.99):.1f} мкс")
+
+    samples = []
+    for note_id in range(count + 1, count + 2001):
+        started = time.perf_counter()
+        index.note_deleted('user@site.com', note_id)
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    print(f"удаление: медиана {statistics.median(samples):.1f} мкс, p99 {percentile(samples, 0.99):.1f} мкс")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
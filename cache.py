@@ -0,0 +1,90 @@
+# cache.py
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class ByteLRUCache:
+    """LRU-кэш, ограниченный суммарным размером значений в байтах"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, size: int = None):
+        if size is None:
+            size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
+
+    def pop(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            self.size -= item[1]
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+class TTLCache:
+    """Кэш с ограниченным временем жизни и числом записей"""
+
+    def __init__(self, ttl: float, max_items: int = 256):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            if item[1] <= time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
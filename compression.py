@@ -0,0 +1,108 @@
+# compression.py
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # Без zstandard заметки сжимаются zlib
+    zstandard = None
+
+# Первый байт сжатого текста - формат, чтобы читать записи, сжатые любым из них
+ZLIB = b'\x01'
+ZSTD = b'\x02'
+
+
+class PackedText:
+    """Сжатый текст заметки, который распаковывается при первом обращении
+
+    Если карточка заметки взята из кэша фрагментов, распаковка не нужна вовсе.
+    """
+
+    __slots__ = ('_codec', '_data', '_text')
+
+    def __init__(self, codec, data: bytes):
+        self._codec = codec
+        self._data = data
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self._codec.unpack(self._data)
+            self._data = None
+        return self._text
+
+    def __len__(self):
+        return len(str(self))
+
+    def __getitem__(self, key):
+        return str(self)[key]
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __getattr__(self, name):
+        return getattr(str(self), name)
+
+    def __repr__(self):
+        return f"PackedText({str(self)!r})"
+
+
+class ContentCodec:
+    """Сжатие больших текстов заметок для хранения в notes.content_packed"""
+
+    def __init__(self, threshold: int = 4096, algorithm: str = None, level: int = None,
+                 min_ratio: float = 0.9, enabled: bool = True):
+        # threshold - минимальный размер текста в байтах UTF-8
+        self.threshold = threshold
+        self.algorithm = algorithm or ('zstd' if zstandard else 'zlib')
+        if self.algorithm == 'zstd' and zstandard is None:
+            raise RuntimeError("Для сжатия zstd нужен пакет zstandard")
+        self.level = level if level is not None else (3 if self.algorithm == 'zstd' else 6)
+        # Сжатие, сэкономившее меньше (1 - min_ratio) размера, не стоит распаковки
+        self.min_ratio = min_ratio
+        self.enabled = enabled
+
+    def pack(self, text: str):
+        """Возвращает сжатый текст с маркером формата или None, если сжимать не стоит"""
+        if not self.enabled:
+            return None
+        raw = text.encode('utf-8')
+        if len(raw) < self.threshold:
+            return None
+        if self.algorithm == 'zstd':
+            # Компрессор zstandard не потокобезопасен, поэтому создается на каждый вызов
+            data = ZSTD + zstandard.ZstdCompressor(level=self.level).compress(raw)
+        else:
+            data = ZLIB + zlib.compress(raw, self.level)
+        if len(data) > len(raw) * self.min_ratio:
+            return None
+        return data
+
+    def unpack(self, data: bytes) -> str:
+        data = bytes(data)
+        marker, payload = data[:1], data[1:]
+        if marker == ZLIB:
+            return zlib.decompress(payload).decode('utf-8')
+        if marker == ZSTD:
+            if zstandard is None:
+                raise RuntimeError("Для чтения заметок, сжатых zstd, нужен пакет zstandard")
+            return zstandard.ZstdDecompressor().decompress(payload).decode('utf-8')
+        raise ValueError(f"Неизвестный формат сжатия: {marker!r}")
+
+    def split(self, text: str):
+        """Значения для столбцов (content, content_packed) при записи заметки"""
+        data = self.pack(text)
+        if data is None:
+            return text, None
+        return '', data
+
+    def content(self, content, packed):
+        """Текст заметки из пары столбцов; сжатый текст распаковывается лениво"""
+        if packed is None:
+            return content
+        return PackedText(self, packed)
+
+
+codec = ContentCodec()
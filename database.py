@@ -1,6 +1,391 @@
 # database.py
+import random
+from collections import OrderedDict
+import threading
+import time
+
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, errorcode, errors
+
+from slow_query import calling_function, slow_query_log
+
+# Ошибки, после которых соединение считается потерянным
+CONNECTION_ERRORS = {
+    errorcode.CR_CONN_HOST_ERROR,
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_SERVER_LOST_EXTENDED,
+}
+
+# Ошибки, при которых читающий запрос можно безопасно повторить
+TRANSIENT_ERRORS = CONNECTION_ERRORS | {
+    errorcode.ER_LOCK_DEADLOCK,
+    errorcode.ER_LOCK_WAIT_TIMEOUT,
+}
+
+_READ_STATEMENTS = ('SELECT', 'SHOW', 'EXPLAIN', 'DESCRIBE')
+_PREPARABLE_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Ошибки, после которых запрос нужно подготовить заново или выполнить без подготовки
+_REPREPARE_ERRORS = {
+    errorcode.ER_UNSUPPORTED_PS,
+    errorcode.ER_UNKNOWN_STMT_HANDLER,
+    errorcode.ER_NEED_REPREPARE,
+    errorcode.ER_MAX_PREPARED_STMT_COUNT_REACHED,
+}
+
+
+def is_read_statement(sql: str) -> bool:
+    """Проверяет, что запрос только читает данные"""
+    return sql.lstrip().upper().startswith(_READ_STATEMENTS)
+
+
+class DatabaseUnavailable(Exception):
+    """База данных недоступна, запрос следует повторить позже"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("База данных временно недоступна")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Размыкатель цепи для подключений к базе данных"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 3, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_count = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_attempt(self):
+        """Разрешает попытку подключения или сразу отказывает, пока цепь разомкнута"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN and now >= self._open_until:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                # Пробное подключение пропускаем только одно
+                self._trial_in_flight = True
+                return
+            raise DatabaseUnavailable(self._retry_after(now))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._opened_count = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._open()
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return self._retry_after(time.monotonic())
+
+    def _open(self):
+        # Экспоненциальная задержка с джиттером: половина фиксирована, половина случайна
+        delay = min(self.max_delay, self.base_delay * 2 ** self._opened_count)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self._opened_count += 1
+        self._open_until = time.monotonic() + delay
+        self.state = self.OPEN
+
+    def _retry_after(self, now: float) -> float:
+        return max(self._open_until - now, 0.0)
+
+
+class PreparedResult:
+    """Буферизованный результат подготовленного запроса"""
+
+    def __init__(self, cursor, dictionary: bool):
+        self.lastrowid = cursor.lastrowid
+        self.description = cursor.description
+        self.column_names = cursor.column_names
+        self.with_rows = cursor.with_rows
+        rows = cursor.fetchall() if cursor.with_rows else []
+        if dictionary:
+            rows = [dict(zip(self.column_names, row)) for row in rows]
+        self.rowcount = len(rows) if self.with_rows else cursor.rowcount
+        self._rows = rows
+        self._position = 0
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+    def fetchmany(self, size: int = 1):
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+
+class StatementCache:
+    """LRU подготовленных запросов одного соединения, ключ - текст запроса
+
+    Соединение общее для потоков пула, поэтому словарь и подготовленные
+    курсоры используются только под lock: выполнение запроса и чтение его
+    результата не должны перемежаться с другим потоком.
+    """
+
+    def __init__(self, connection, capacity: int):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self._connection = connection
+        self._statements = OrderedDict()
+        self._rejected = set()
+
+    def accepts(self, sql: str) -> bool:
+        return sql not in self._rejected and sql.lstrip().upper().startswith(_PREPARABLE_STATEMENTS)
+
+    def get(self, sql: str):
+        """Возвращает (исходный текст, подготовленный курсор) для запроса
+
+        Курсор можно использовать, только пока вызывающий держит lock.
+        """
+        with self.lock:
+            statement = self._statements.get(sql)
+            if statement is not None:
+                self._statements.move_to_end(sql)
+                self.hits += 1
+                return statement
+
+            self.misses += 1
+            # Драйвер готовит запрос заново, если текст - другой объект str,
+            # поэтому вместе с курсором храним тот объект, с которым он был подготовлен
+            statement = (sql, self._connection.cursor(prepared=True))
+            self._statements[sql] = statement
+            if len(self._statements) > self.capacity:
+                _, (_, evicted) = self._statements.popitem(last=False)
+                self._close(evicted)
+            return statement
+
+    def discard(self, sql: str, reject: bool = False):
+        with self.lock:
+            statement = self._statements.pop(sql, None)
+            if statement is not None:
+                self._close(statement[1])
+            if reject:
+                self._rejected.add(sql)
+
+    def clear(self):
+        with self.lock:
+            for _, cursor in self._statements.values():
+                self._close(cursor)
+            self._statements.clear()
+
+    @staticmethod
+    def _close(cursor):
+        try:
+            cursor.close()
+        except Error:
+            pass
+
+
+class TrackedCursor:
+    """Курсор, который замеряет время запросов и повторяет прерванные чтения
+
+    Запросы выполняются через кэш подготовленных запросов соединения, если
+    курсор не потоковый (stream=True) и не создан с особыми параметрами.
+    """
+
+    def __init__(self, connection, args, kwargs):
+        self._connection = connection
+        self._database = connection.database
+        self._args = args
+        self._kwargs = kwargs
+        self._cacheable = not args and set(kwargs) <= {'dictionary'}
+        self._dictionary = kwargs.get('dictionary', False)
+        connection.current()
+        self._cursor = None
+        self._result = None
+        self._pending = None
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._finish()
+        read = is_read_statement(operation)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                result = self._execute(operation, params, *args, **kwargs)
+                # Вызывающую функцию запоминаем сейчас: к _finish() стек уже будет другим
+                self._pending = [operation, params, time.perf_counter() - started, calling_function()]
+                self._connection.mark_used(read)
+                return result
+            except Error as e:
+                if e.errno in CONNECTION_ERRORS:
+                    self._database.mark_lost(self._connection.raw)
+                if not (read and e.errno in TRANSIENT_ERRORS
+                        and attempt < self._database.read_retries
+                        and self._connection.can_retry()):
+                    raise
+            attempt += 1
+            self._database.backoff(attempt)
+            self._reopen()
+
+    def fetchone(self):
+        return self._timed(self._source().fetchone)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._timed(self._source().fetchmany, *args, **kwargs)
+
+    def fetchall(self):
+        return self._timed(self._source().fetchall)
+
+    def close(self):
+        self._finish()
+        self._result = None
+        if self._cursor is None:
+            return True
+        try:
+            return self._cursor.close()
+        except Error:
+            # Курсор потерянного соединения закрыть нельзя, но и держать нечего
+            return False
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._source(), name)
+
+    def _execute(self, operation, params, *args, **kwargs):
+        self._result = None
+        # Кэш запросов принадлежит текущему соединению базы: сначала убеждаемся, что это наше
+        self._connection.current()
+        statements = self._database.statements
+        if self._cacheable and statements is not None and not args and not kwargs \
+                and statements.accepts(operation):
+            # Курсор общий для всех потоков: выполняем и сразу буферизуем результат под блокировкой
+            with statements.lock:
+                sql, cursor = statements.get(operation)
+                try:
+                    cursor.execute(sql, params)
+                except Error as e:
+                    if e.errno not in _REPREPARE_ERRORS:
+                        raise
+                    # Запрос нельзя подготовить или его дескриптор устарел - выполняем обычным способом
+                    statements.discard(operation, reject=e.errno == errorcode.ER_UNSUPPORTED_PS)
+                else:
+                    self._result = PreparedResult(cursor, self._dictionary)
+                    return None
+        return self._raw().execute(operation, params, *args, **kwargs)
+
+    def _raw(self):
+        if self._cursor is None:
+            self._cursor = self._connection.current().cursor(*self._args, **self._kwargs)
+        return self._cursor
+
+    def _source(self):
+        return self._result if self._result is not None else self._raw()
+
+    def _reopen(self):
+        """Открывает курсор заново, при необходимости переподключаясь"""
+        if self._cursor is not None:
+            try:
+                self._cursor.close()
+            except Error:
+                pass
+            self._cursor = None
+        self._result = None
+        self._database.ensure_connection()
+        self._connection.repin()
+
+    def _timed(self, fetch, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fetch(*args, **kwargs)
+        finally:
+            if self._pending is not None:
+                self._pending[2] += time.perf_counter() - started
+
+    def _finish(self):
+        """Передает завершенный запрос в журнал медленных запросов"""
+        if self._pending is None:
+            return
+        operation, params, duration, function = self._pending
+        self._pending = None
+        slow_query_log.observe(operation, params, duration, self._database.explain, function)
+
+
+class TrackedConnection:
+    """Обертка над соединением базы, выдающая отслеживаемые курсоры
+
+    Запоминает соединение, текущее на момент создания. Если тем временем
+    другой поток переподключился, изменения остались в потерянном соединении:
+    запросы и commit() выбрасывают ошибку, а не продолжают на новом.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.raw = database.current()
+        # Были ли записи после последнего commit/rollback
+        self.uncommitted = False
+
+    def current(self):
+        """Возвращает запомненное соединение или ошибку, если его заменили"""
+        if self.database.connection is not self.raw:
+            raise errors.OperationalError(msg="Соединение с MySQL потеряно, транзакция не сохранена",
+                                          errno=errorcode.CR_SERVER_LOST)
+        return self.raw
+
+    def repin(self):
+        """Переходит на текущее соединение базы после переподключения для повтора чтения"""
+        self.raw = self.database.current()
+
+    def mark_used(self, read: bool):
+        self.database.mark_used()
+        if not read:
+            self.uncommitted = True
+
+    def can_retry(self) -> bool:
+        # Повтор на новом соединении потерял бы незакоммиченные изменения
+        return not self.uncommitted
+
+    def cursor(self, *args, stream: bool = False, **kwargs):
+        """Создает курсор; stream=True - небуферизованное чтение без кэша запросов"""
+        if stream:
+            kwargs['buffered'] = False
+        return TrackedCursor(self, args, kwargs)
+
+    def commit(self):
+        self.current().commit()
+        self.uncommitted = False
+
+    def rollback(self):
+        self.uncommitted = False
+        # Транзакцию потерянного соединения сервер уже откатил, а новое трогать нельзя
+        if self.database.connection is not self.raw:
+            return
+        self.raw.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
 
 
 class Database:
@@ -10,33 +395,148 @@ class Database:
         self.user = 'root'
         self.password = 'usbw'
         self.port = 3307
+        self.connect_timeout = 3
+        self.health_check_interval = 30
+        self.read_retries = 2
+        self.retry_delay = 0.05
+        # Выключено: драйвер перед каждым повторным выполнением шлет COM_STMT_RESET,
+        # лишний round-trip съедает выигрыш. Включать, если bench_prepared.py покажет пользу
+        self.use_prepared_statements = False
+        self.statement_cache_size = 64
+        self.breaker = CircuitBreaker()
         self.connection = None
+        self.statements = None
+        self._last_used = 0.0
+        # Переподключение одно на всех: остальные потоки ждут его результата
+        self._connect_lock = threading.Lock()
+        self._connect_attempts = 0
+        self._explain_connection = None
+        self._explain_lock = threading.Lock()
+
+    def _connect(self):
+        """Открывает новое соединение с базой данных"""
+        return mysql.connector.connect(
+            host=self.host,
+            database=self.database,
+            user=self.user,
+            password=self.password,
+            port=self.port,
+            charset='utf8',
+            collation='utf8_general_ci',
+            use_unicode=True,
+            connection_timeout=self.connect_timeout
+        )
 
     def get_connection(self):
-        """Возвращает соединение с базой данных"""
+        """Возвращает соединение с базой данных
+
+        Пока цепь разомкнута, сразу выбрасывает DatabaseUnavailable.
+        """
+        self.ensure_connection()
+        return TrackedConnection(self)
+
+    def ensure_connection(self):
+        """Проверяет соединение и переподключается, если оно потеряно"""
+        if self.connection is not None and self._is_healthy():
+            return
+
+        attempts = self._connect_attempts
+        with self._connect_lock:
+            # Пока ждали блокировку, другой поток мог уже переподключиться
+            if self.connection is not None and self._is_healthy():
+                return
+            if self._connect_attempts != attempts:
+                # Другой поток только что не смог подключиться - не повторяем за ним
+                raise DatabaseUnavailable(self.breaker.retry_after())
+            self._connect_attempts += 1
+
+            self.breaker.before_attempt()
+            try:
+                connection = self._connect()
+            except Error as e:
+                self._drop_connection()
+                self.breaker.record_failure()
+                print(f"❌ Ошибка подключения к MySQL: {e}")
+                raise DatabaseUnavailable(self.breaker.retry_after()) from e
+
+            self.breaker.record_success()
+            # Подготовленные запросы живут в рамках соединения: после переподключения готовим заново
+            self.statements = (StatementCache(connection, self.statement_cache_size)
+                               if self.use_prepared_statements else None)
+            self._last_used = time.monotonic()
+            self.connection = connection
+        print("✅ Успешное подключение к MySQL (utf8)")
+
+    def current(self):
+        """Возвращает текущее соединение или ошибку, если оно было потеряно"""
+        if self.connection is None:
+            raise errors.OperationalError(msg="Соединение с MySQL потеряно", errno=errorcode.CR_SERVER_LOST)
+        return self.connection
+
+    def _is_healthy(self) -> bool:
+        # Недавно использованное соединение не проверяем, чтобы не тратить лишний round-trip
+        if time.monotonic() - self._last_used < self.health_check_interval:
+            return True
         try:
-            if self.connection is None or not self.connection.is_connected():
-                self.connection = mysql.connector.connect(
-                    host=self.host,
-                    database=self.database,
-                    user=self.user,
-                    password=self.password,
-                    port=self.port,
-                    charset='utf8',
-                    collation='utf8_general_ci',
-                    use_unicode=True
-                )
-                print("✅ Успешное подключение к MySQL (utf8)")
-            return self.connection
-        except Error as e:
-            print(f"❌ Ошибка подключения к MySQL: {e}")
-            return None
+            self.connection.ping(reconnect=False)
+        except Error:
+            self._drop_connection()
+            return False
+        self._last_used = time.monotonic()
+        return True
+
+    def mark_used(self):
+        self._last_used = time.monotonic()
+
+    def mark_lost(self, connection):
+        """Отмечает потерю соединения для размыкателя цепи
+
+        Ошибка на соединении, которое уже заменено новым, ничего не сбрасывает.
+        """
+        if self.connection is not connection:
+            return
+        self._drop_connection()
+        self.breaker.record_failure()
+
+    def _drop_connection(self):
+        self.connection = None
+        self.statements = None
+
+    def backoff(self, attempt: int):
+        """Ждет перед повтором запроса (экспоненциально, с джиттером)"""
+        time.sleep(random.uniform(0, self.retry_delay * 2 ** attempt))
+
+    def explain(self, sql: str, params=None):
+        """Выполняет EXPLAIN для запроса в отдельном соединении"""
+        with self._explain_lock:
+            if self._explain_connection is None or not self._explain_connection.is_connected():
+                self._explain_connection = self._connect()
+
+            cursor = self._explain_connection.cursor(dictionary=True)
+            try:
+                cursor.execute(f"EXPLAIN {sql}", params)
+                plan = [{key: value if isinstance(value, (int, float, type(None))) else str(value)
+                         for key, value in row.items()} for row in cursor.fetchall()]
+                # EXPLAIN для INSERT/UPDATE/DELETE не изменяет данные, но открывает транзакцию
+                self._explain_connection.rollback()
+                return plan
+            finally:
+                cursor.close()
 
     def close_connection(self):
         """Закрывает соединение с базой данных"""
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            self.connection = None
+        if self.statements is not None:
+            self.statements.clear()
+        if self.connection is not None:
+            # Без проверки is_connected: ping не проходит, пока есть непрочитанный результат
+            try:
+                self.connection.close()
+            except Error:
+                pass
+        self._drop_connection()
+        if self._explain_connection and self._explain_connection.is_connected():
+            self._explain_connection.close()
+            self._explain_connection = None
 
 
-db = Database()
\ No newline at end of file
+db = Database()
@@ -1,4 +1,19 @@
-from database import db
+import base64
+import json
+from datetime import datetime
+
+from database import db, Database, DatabaseUnavailable
+from cache import TTLCache
+from compression import codec
+from deltas import apply_ops, DeltaError, VersionConflict
+from jobs import enqueue_job, job_runner
+from records import fetch_records, iter_records
+from revisions import record_change, list_revisions, load_revision
+from schema import ensure_column, ensure_index, migration
+from tags import (
+    MAX_FILTER_TAGS, set_note_tags, release_note_tags, get_note_tag_names, tagged_notes_query
+)
+from typeahead import title_index
 from models import UserRegister, UserLogin
 from passlib.context import CryptContext
 from mysql.connector import Error
@@ -15,11 +30,21 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def _rollback(connection):
+    """Откатывает недописанную транзакцию, чтобы ее не зафиксировал чужой commit()
+
+    Соединение общее для всех запросов, поэтому после ошибки в середине
+    транзакции ее нужно откатить явно.
+    """
+    try:
+        connection.rollback()
+    except Error as e:
+        print(f"Ошибка при откате транзакции: {e}")
+
+
 def create_user(user: UserRegister):
     """Создает нового пользователя в MySQL"""
     connection = db.get_connection()
-    if not connection:
-        return False, "Ошибка подключения к базе данных"
 
     try:
         cursor = connection.cursor()
@@ -52,8 +77,6 @@ def create_user(user: UserRegister):
 def authenticate_user(user_login: UserLogin, ip_address: str = None):
     """Аутентифицирует пользователя"""
     connection = db.get_connection()
-    if not connection:
-        return False, "Ошибка подключения к базе данных", None, None
 
     try:
         cursor = connection.cursor(dictionary=True)
@@ -85,8 +108,6 @@ def authenticate_user(user_login: UserLogin, ip_address: str = None):
 def get_user_by_email(email: str):
     """Находит пользователя по email"""
     connection = db.get_connection()
-    if not connection:
-        return None
 
     try:
         cursor = connection.cursor(dictionary=True)
@@ -99,16 +120,14 @@ def get_user_by_email(email: str):
         cursor.close()
 
 
-def get_all_users():
+def get_all_users(compact: bool = False):
     """Возвращает всех пользователей"""
     connection = db.get_connection()
-    if not connection:
-        return []
 
     try:
-        cursor = connection.cursor(dictionary=True)
+        cursor = connection.cursor(dictionary=not compact)
         cursor.execute("SELECT id, name, email, role, last_login, created_at FROM users ORDER BY created_at DESC")
-        return cursor.fetchall()
+        return fetch_records(cursor) if compact else cursor.fetchall()
     except Error as e:
         print(f"Ошибка при получении пользователей: {e}")
         return []
@@ -116,6 +135,111 @@ def get_all_users():
         cursor.close()
 
 
+# Каталог пользователей: сортировка -> (столбец, направление)
+DIRECTORY_SORTS = {
+    'newest': ('created_at', 'DESC'),
+    'name': ('name', 'ASC'),
+}
+
+# Публичные страницы каталога одинаковы для всех обычных пользователей
+_directory_cache = TTLCache(ttl=30, max_items=512)
+
+
+def encode_directory_cursor(sort: str, row) -> str:
+    """Курсор следующей страницы: значение столбца сортировки и id последней строки"""
+    value = row[DIRECTORY_SORTS[sort][0]]
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, row['id']]).encode('utf-8')).decode('ascii')
+
+
+def decode_directory_cursor(sort: str, cursor: str):
+    """Разбирает курсор страницы; ValueError, если он поврежден"""
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if DIRECTORY_SORTS[sort][0] == 'created_at':
+            value = datetime.fromisoformat(value)
+        return value, int(last_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Некорректный курсор страницы: {e}") from None
+
+
+def get_users_directory(viewer_role: str, sort: str = 'newest', after: str = None, limit: int = 50):
+    """Возвращает страницу каталога пользователей и курсор следующей страницы
+
+    Обычным пользователям отдаются только имя, дата регистрации и email,
+    замаскированный в SQL; страница выбирается по индексу (keyset), без OFFSET.
+    """
+    if sort not in DIRECTORY_SORTS:
+        raise ValueError(f"Неизвестная сортировка: {sort}")
+    column, direction = DIRECTORY_SORTS[sort]
+    is_admin_view = viewer_role == 'admin'
+
+    cache_key = (sort, after, limit)
+    if not is_admin_view:
+        cached = _directory_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    if is_admin_view:
+        columns = "id, name, email, role, last_login, created_at"
+    else:
+        columns = "id, name, CONCAT(SUBSTRING_INDEX(email, '@', 1), '@***') AS email, created_at"
+
+    query = f"SELECT {columns} FROM users"
+    params = ()
+    if after:
+        value, last_id = decode_directory_cursor(sort, after)
+        comparison = '<' if direction == 'DESC' else '>'
+        query += f" WHERE {column} {comparison} %s OR ({column} = %s AND id {comparison} %s)"
+        params = (value, value, last_id)
+    query += f" ORDER BY {column} {direction}, id {direction} LIMIT %s"
+    params += (limit + 1,)
+
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        users = fetch_records(cursor)
+    except Error as e:
+        print(f"Ошибка при получении каталога пользователей: {e}")
+        return [], None
+    finally:
+        cursor.close()
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_directory_cursor(sort, users[-1])
+
+    page = (users, next_cursor)
+    if not is_admin_view:
+        _directory_cache.set(cache_key, page)
+    return page
+
+
+def count_users():
+    """Возвращает количество пользователей (кэшируется на время жизни страниц каталога)"""
+    cached = _directory_cache.get('count')
+    if cached is not None:
+        return cached
+
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM users")
+        total = cursor.fetchone()[0]
+        _directory_cache.set('count', total)
+        return total
+    except Error as e:
+        print(f"Ошибка при подсчете пользователей: {e}")
+        return 0
+    finally:
+        cursor.close()
+
+
 def is_admin(user_email: str):
     """Проверяет, является ли пользователь администратором"""
     user = get_user_by_email(user_email)
@@ -123,11 +247,9 @@ def is_admin(user_email: str):
 
 
 # Функции для заметок
-def create_user_note(title: str, content: str, user_email: str):
+def create_user_note(title: str, content: str, user_email: str, tags: list = None):
     """Создает новую заметку для пользователя"""
     connection = db.get_connection()
-    if not connection:
-        return None
 
     try:
         cursor = connection.cursor()
@@ -140,42 +262,53 @@ def create_user_note(title: str, content: str, user_email: str):
 
         user_id = user[0]
 
-        # Создаем заметку
+        # Создаем заметку и увеличиваем счетчик в одной транзакции
+        stored, packed = codec.split(content)
         cursor.execute(
-            "INSERT INTO notes (title, content, user_id) VALUES (%s, %s, %s)",
-            (title, content, user_id)
+            "INSERT INTO notes (title, content, content_packed, user_id) VALUES (%s, %s, %s, %s)",
+            (title, stored, packed, user_id)
         )
+        note_id = cursor.lastrowid
+        if tags:
+            set_note_tags(cursor, user_id, note_id, tags)
+        cursor.execute("UPDATE users SET note_count = note_count + 1 WHERE id = %s", (user_id,))
         connection.commit()
 
+        title_index.note_saved(user_email, note_id, title)
+
         # Логируем создание заметки
-        note_id = cursor.lastrowid
         log_user_activity(user_id, 'create_note', f'Создана заметка "{title}"')
 
         return note_id
 
     except Error as e:
+        _rollback(connection)
         print(f"Ошибка при создании заметки: {e}")
         return None
     finally:
         cursor.close()
 
 
-def get_user_notes(user_email: str):
-    """Возвращает все заметки пользователя"""
+def get_user_notes(user_email: str, compact: bool = False, limit: int = None, offset: int = 0):
+    """Возвращает заметки пользователя (все или одну страницу, если задан limit)"""
     connection = db.get_connection()
-    if not connection:
-        return []
 
     try:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT n.id, n.title, n.content, n.created_at, n.updated_at 
+        cursor = connection.cursor(dictionary=not compact)
+        query = """
+            SELECT n.id, n.title, n.content, n.content_packed, n.version, n.created_at, n.updated_at 
             FROM notes n 
             JOIN users u ON n.user_id = u.id 
             WHERE u.email = %s 
             ORDER BY n.updated_at DESC
-        """, (user_email,))
-        return cursor.fetchall()
+        """
+        params = (user_email,)
+        if limit is not None:
+            query += " LIMIT %s OFFSET %s"
+            params = (user_email, limit, offset)
+        cursor.execute(query, params)
+        rows = fetch_records(cursor) if compact else cursor.fetchall()
+        return [unpack_note(row) for row in rows]
     except Error as e:
         print(f"Ошибка при получении заметок: {e}")
         return []
@@ -186,18 +319,17 @@ def get_user_notes(user_email: str):
 def get_note_by_id(note_id: int, user_email: str):
     """Возвращает конкретную заметку пользователя"""
     connection = db.get_connection()
-    if not connection:
-        return None
 
     try:
         cursor = connection.cursor(dictionary=True)
         cursor.execute("""
-            SELECT n.id, n.title, n.content, n.created_at, n.updated_at 
+            SELECT n.id, n.title, n.content, n.content_packed, n.version, n.created_at, n.updated_at 
             FROM notes n 
             JOIN users u ON n.user_id = u.id 
             WHERE n.id = %s AND u.email = %s
         """, (note_id, user_email))
-        return cursor.fetchone()
+        note = cursor.fetchone()
+        return unpack_note(note) if note else None
     except Error as e:
         print(f"Ошибка при получении заметки: {e}")
         return None
@@ -208,8 +340,6 @@ def get_note_by_id(note_id: int, user_email: str):
 def delete_user_note(note_id: int, user_email: str):
     """Удаляет заметку пользователя"""
     connection = db.get_connection()
-    if not connection:
-        return False
 
     try:
         cursor = connection.cursor()
@@ -222,16 +352,27 @@ def delete_user_note(note_id: int, user_email: str):
 
         user_id = user[0]
 
-        # Удаляем заметку
+        # Удаляем заметку и уменьшаем счетчик в одной транзакции
         cursor.execute("DELETE FROM notes WHERE id = %s AND user_id = %s", (note_id, user_id))
+        deleted = cursor.rowcount
+        if deleted:
+            cursor.execute(
+                "UPDATE users SET note_count = GREATEST(note_count - %s, 0) WHERE id = %s",
+                (deleted, user_id)
+            )
+            cursor.execute("DELETE FROM note_revisions WHERE note_id = %s", (note_id,))
+            release_note_tags(cursor, [note_id])
         connection.commit()
 
+        title_index.note_deleted(user_email, note_id)
+
         # Логируем удаление
         log_user_activity(user_id, 'delete_note', f'Удалена заметка #{note_id}')
 
-        return cursor.rowcount > 0
+        return deleted > 0
 
     except Error as e:
+        _rollback(connection)
         print(f"Ошибка при удалении заметки: {e}")
         return False
     finally:
@@ -239,10 +380,11 @@ def delete_user_note(note_id: int, user_email: str):
 
 
 def delete_all_user_notes(user_email: str):
-    """Удаляет все заметки пользователя"""
+    """Ставит в очередь удаление всех заметок пользователя, возвращает id задачи
+
+    Удаление выполняется фоновым исполнителем порциями, см. jobs.py.
+    """
     connection = db.get_connection()
-    if not connection:
-        return False
 
     try:
         cursor = connection.cursor()
@@ -251,22 +393,23 @@ def delete_all_user_notes(user_email: str):
         cursor.execute("SELECT id FROM users WHERE email = %s", (user_email,))
         user = cursor.fetchone()
         if not user:
-            return False
+            return None
 
         user_id = user[0]
 
-        # Удаляем все заметки пользователя
-        cursor.execute("DELETE FROM notes WHERE user_id = %s", (user_id,))
-        connection.commit()
+        # Удаляются только заметки, существующие на момент запроса
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM notes WHERE user_id = %s", (user_id,))
+        max_note_id = cursor.fetchone()[0]
 
-        # Логируем удаление всех заметок
-        log_user_activity(user_id, 'delete_all_notes', 'Удалены все заметки')
+        job_id = enqueue_job(cursor, user_id, 'delete_all_notes', max_note_id)
+        connection.commit()
+        job_runner.notify()
 
-        return True
+        return job_id
 
     except Error as e:
         print(f"Ошибка при удалении всех заметок: {e}")
-        return False
+        return None
     finally:
         cursor.close()
 
@@ -274,8 +417,6 @@ def delete_all_user_notes(user_email: str):
 def update_user_note(note_id: int, title: str, content: str, user_email: str):
     """Обновляет заметку пользователя"""
     connection = db.get_connection()
-    if not connection:
-        return False
 
     try:
         cursor = connection.cursor()
@@ -288,22 +429,248 @@ def update_user_note(note_id: int, title: str, content: str, user_email: str):
 
         user_id = user[0]
 
-        # Обновляем заметку
+        # Блокируем строку заметки, чтобы версии в истории шли друг за другом
+        cursor.execute(
+            "SELECT title, content, content_packed, version FROM notes WHERE id = %s AND user_id = %s FOR UPDATE",
+            (note_id, user_id)
+        )
+        note = cursor.fetchone()
+        if not note:
+            connection.rollback()
+            return False
+        old_title, old_content, old_packed, version = note
+
+        # Обновляем заметку и пишем новую версию в историю в одной транзакции
+        stored, packed = codec.split(content)
         cursor.execute(
-            "UPDATE notes SET title = %s, content = %s WHERE id = %s AND user_id = %s",
-            (title, content, note_id, user_id)
+            "UPDATE notes SET title = %s, content = %s, content_packed = %s, version = version + 1 "
+            "WHERE id = %s AND user_id = %s",
+            (title, stored, packed, note_id, user_id)
         )
+        record_change(cursor, note_id, version, old_title, str(codec.content(old_content, old_packed)),
+                      title, content)
         connection.commit()
 
+        title_index.note_saved(user_email, note_id, title)
+
         # Логируем обновление
-        if cursor.rowcount > 0:
-            log_user_activity(user_id, 'update_note', f'Обновлена заметка "{title}"')
+        log_user_activity(user_id, 'update_note', f'Обновлена заметка "{title}"')
+
+        return True
+
+    except Error as e:
+        _rollback(connection)
+        print(f"Ошибка при обновлении заметки: {e}")
+        return False
+    finally:
+        cursor.close()
+
+
+def patch_user_note(note_id: int, user_email: str, base_version: int, base_length: int, ops,
+                    title: str = None):
+    """Применяет правки к тексту заметки, если она не менялась с base_version
+
+    Позиции правок считаются по тексту с переводами строк \\n; base_length - длина
+    этого текста у клиента: если она не совпала, правки относятся к другому тексту.
+    Возвращает новую версию или None, если заметка не найдена.
+    Выбрасывает VersionConflict при устаревшей версии и DeltaError при некорректных правках.
+    """
+    connection = db.get_connection()
 
-        return cursor.rowcount > 0
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT n.user_id, n.title, n.content, n.content_packed, n.version
+            FROM notes n
+            JOIN users u ON n.user_id = u.id
+            WHERE n.id = %s AND u.email = %s
+        """, (note_id, user_email))
+        note = cursor.fetchone()
+        if not note:
+            return None
+
+        user_id, old_title, content, packed, version = note
+        if version != base_version:
+            raise VersionConflict(version)
+
+        original = str(codec.content(content, packed))
+        # Формы отправляют переводы строк как \r\n, а браузер считает позиции по \n
+        content = original.replace('\r\n', '\n').replace('\r', '\n')
+        if len(content) != base_length:
+            raise DeltaError(f"Правки рассчитаны на текст длиной {base_length}, "
+                             f"а в заметке {len(content)} символов")
+        new_title = old_title if title is None else title
+        new_content = apply_ops(content, ops)
+        stored, packed = codec.split(new_content)
+
+        # Оптимистическая блокировка: запись пройдет, только если версия не изменилась
+        cursor.execute(
+            "UPDATE notes SET title = %s, content = %s, content_packed = %s, version = version + 1 "
+            "WHERE id = %s AND version = %s",
+            (new_title, stored, packed, note_id, base_version)
+        )
+        if cursor.rowcount == 0:
+            connection.rollback()
+            cursor.execute("SELECT version FROM notes WHERE id = %s", (note_id,))
+            current = cursor.fetchone()
+            if not current:
+                return None
+            raise VersionConflict(current[0])
+        # Если переводы строк нормализованы, правки не применимы к сохраненному тексту -
+        # история вычисляет их заново
+        record_change(cursor, note_id, base_version, old_title, original, new_title, new_content,
+                      ops if content == original else None)
+        connection.commit()
+
+        if new_title != old_title:
+            title_index.note_saved(user_email, note_id, new_title)
+
+        log_user_activity(user_id, 'update_note', f'Обновлена заметка "{new_title}"')
+
+        return base_version + 1
 
     except Error as e:
+        _rollback(connection)
         print(f"Ошибка при обновлении заметки: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+def _owns_note(cursor, note_id: int, user_email: str) -> bool:
+    cursor.execute("""
+        SELECT n.id FROM notes n
+        JOIN users u ON n.user_id = u.id
+        WHERE n.id = %s AND u.email = %s
+    """, (note_id, user_email))
+    return bool(cursor.fetchall())
+
+
+def get_note_revisions(note_id: int, user_email: str):
+    """Возвращает список версий заметки (новые первыми) или None, если заметка не найдена"""
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        if not _owns_note(cursor, note_id, user_email):
+            return None
+        return list_revisions(cursor, note_id)
+    except Error as e:
+        print(f"Ошибка при получении истории заметки: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+def get_note_revision(note_id: int, user_email: str, version: int):
+    """Возвращает заголовок и текст версии заметки или None"""
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor()
+        if not _owns_note(cursor, note_id, user_email):
+            return None
+        revision = load_revision(cursor, note_id, version)
+        if revision is None:
+            return None
+        return {'id': note_id, 'version': version, 'title': revision[0], 'content': revision[1]}
+    except Error as e:
+        print(f"Ошибка при получении версии заметки: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+def restore_note_revision(note_id: int, user_email: str, version: int):
+    """Восстанавливает версию заметки; восстановление само становится новой версией"""
+    revision = get_note_revision(note_id, user_email, version)
+    if revision is None:
         return False
+    return update_user_note(note_id, revision['title'], revision['content'], user_email)
+
+
+def set_user_note_tags(note_id: int, user_email: str, tags: list):
+    """Заменяет теги заметки; возвращает итоговый список или None, если заметка не найдена"""
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT n.user_id FROM notes n
+            JOIN users u ON n.user_id = u.id
+            WHERE n.id = %s AND u.email = %s
+            FOR UPDATE
+        """, (note_id, user_email))
+        note = cursor.fetchone()
+        if not note:
+            connection.rollback()
+            return None
+
+        set_note_tags(cursor, note[0], note_id, tags)
+        connection.commit()
+        return get_note_tag_names(cursor, note_id)
+    except Error as e:
+        _rollback(connection)
+        print(f"Ошибка при изменении тегов заметки: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+def get_user_tags(user_email: str):
+    """Теги пользователя с числом заметок (счетчики ведутся при изменениях, без GROUP BY)"""
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT t.name, t.note_count
+            FROM tags t
+            JOIN users u ON t.user_id = u.id
+            WHERE u.email = %s AND t.note_count > 0
+            ORDER BY t.name
+        """, (user_email,))
+        return cursor.fetchall()
+    except Error as e:
+        print(f"Ошибка при получении тегов: {e}")
+        return []
+    finally:
+        cursor.close()
+
+
+def get_notes_by_tags(user_email: str, tags: list, before: int = None, limit: int = 50):
+    """Страница заметок со всеми указанными тегами, новые первыми
+
+    Возвращает (заметки, id для следующей страницы или None).
+    """
+    if not tags:
+        return [], None
+    if len(tags) > MAX_FILTER_TAGS:
+        raise ValueError(f"Можно фильтровать не больше чем по {MAX_FILTER_TAGS} тегам")
+
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            SELECT t.id, t.note_count FROM tags t
+            JOIN users u ON t.user_id = u.id
+            WHERE u.email = %s AND t.name IN ({', '.join(['%s'] * len(tags))})
+        """, (user_email, *tags))
+        found = cursor.fetchall()
+        if len(found) < len(tags):
+            return [], None
+
+        # Начинаем с самого редкого тега
+        tag_ids = [tag_id for tag_id, _ in sorted(found, key=lambda row: row[1])]
+        query, params = tagged_notes_query(tag_ids, before)
+        cursor.execute(query, (*params, limit + 1))
+        notes = fetch_records(cursor)
+        next_cursor = notes[limit - 1].id if len(notes) > limit else None
+        return notes[:limit], next_cursor
+    except Error as e:
+        print(f"Ошибка при фильтрации заметок по тегам: {e}")
+        return [], None
     finally:
         cursor.close()
 
@@ -312,8 +679,6 @@ def update_user_note(note_id: int, title: str, content: str, user_email: str):
 def log_user_activity(user_id: int, activity_type: str, description: str, ip_address: str = None):
     """Логирует активность пользователя"""
     connection = db.get_connection()
-    if not connection:
-        return
 
     try:
         cursor = connection.cursor()
@@ -328,14 +693,12 @@ def log_user_activity(user_id: int, activity_type: str, description: str, ip_add
         cursor.close()
 
 
-def get_recent_activity(limit: int = 50):
+def get_recent_activity(limit: int = 50, compact: bool = False):
     """Возвращает последнюю активность всех пользователей"""
     connection = db.get_connection()
-    if not connection:
-        return []
 
     try:
-        cursor = connection.cursor(dictionary=True)
+        cursor = connection.cursor(dictionary=not compact)
         cursor.execute("""
             SELECT ua.id, ua.user_id, ua.activity_type, ua.description, ua.ip_address, ua.created_at,
                    u.name as user_name, u.email as user_email
@@ -344,7 +707,7 @@ def get_recent_activity(limit: int = 50):
             ORDER BY ua.created_at DESC
             LIMIT %s
         """, (limit,))
-        return cursor.fetchall()
+        return fetch_records(cursor) if compact else cursor.fetchall()
     except Error as e:
         print(f"Ошибка при получении активности: {e}")
         return []
@@ -352,14 +715,12 @@ def get_recent_activity(limit: int = 50):
         cursor.close()
 
 
-def get_user_activity(user_email: str, limit: int = 20):
+def get_user_activity(user_email: str, limit: int = 20, compact: bool = False):
     """Возвращает активность конкретного пользователя"""
     connection = db.get_connection()
-    if not connection:
-        return []
 
     try:
-        cursor = connection.cursor(dictionary=True)
+        cursor = connection.cursor(dictionary=not compact)
         cursor.execute("""
             SELECT ua.id, ua.activity_type, ua.description, ua.ip_address, ua.created_at
             FROM user_activity ua
@@ -368,7 +729,7 @@ def get_user_activity(user_email: str, limit: int = 20):
             ORDER BY ua.created_at DESC
             LIMIT %s
         """, (user_email, limit))
-        return cursor.fetchall()
+        return fetch_records(cursor) if compact else cursor.fetchall()
     except Error as e:
         print(f"Ошибка при получении активности пользователя: {e}")
         return []
@@ -380,8 +741,6 @@ def get_user_activity(user_email: str, limit: int = 20):
 def get_admin_stats():
     """Возвращает статистику для админ-панели"""
     connection = db.get_connection()
-    if not connection:
-        return None
 
     try:
         cursor = connection.cursor()
@@ -419,43 +778,77 @@ def get_admin_stats():
         cursor.close()
 
 
-def get_all_notes_admin():
-    """Возвращает все заметки (для администратора)"""
+def unpack_note(note):
+    """Подставляет в content текст из content_packed; распаковка произойдет при чтении"""
+    if isinstance(note, dict):
+        note['content'] = codec.content(note['content'], note.pop('content_packed'))
+        return note
+    if note.content_packed is None:
+        return note
+    return note._replace(content=codec.content(note.content, note.content_packed), content_packed=None)
+
+
+def compress_existing_notes():
+    """Ставит в очередь фоновое сжатие уже сохраненных больших заметок, возвращает id задачи"""
     connection = db.get_connection()
-    if not connection:
-        return []
 
     try:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT n.id, n.title, n.content, n.created_at, n.updated_at,
-                   u.name as user_name, u.email as user_email
-            FROM notes n 
-            JOIN users u ON n.user_id = u.id 
-            ORDER BY n.updated_at DESC
-        """)
-        return cursor.fetchall()
+        cursor = connection.cursor()
+        job_id = enqueue_job(cursor, 0, 'compress_notes')
+        connection.commit()
+        job_runner.notify()
+        return job_id
     except Error as e:
-        print(f"Ошибка при получении всех заметок: {e}")
-        return []
+        print(f"Ошибка при постановке задачи сжатия: {e}")
+        return None
     finally:
         cursor.close()
 
 
+_ADMIN_NOTES_QUERY = """
+    SELECT n.id, n.title, n.content, n.content_packed, n.created_at, n.updated_at,
+           u.name as user_name, u.email as user_email
+    FROM notes n 
+    JOIN users u ON n.user_id = u.id 
+    ORDER BY n.updated_at DESC
+"""
+
+
+def iter_all_notes_admin(batch_size: int = 500):
+    """Лениво перебирает все заметки порциями (для администратора)
+
+    Запрос выполняется при первом обращении. Результат читается, пока страница
+    отдается клиенту, поэтому у итератора свое соединение: общее соединение db
+    в это время остается свободным для других запросов.
+    """
+    database = Database()
+    database.breaker = db.breaker
+    database.use_prepared_statements = False
+    try:
+        connection = database.get_connection()
+    except DatabaseUnavailable as e:
+        print(f"Ошибка при получении всех заметок: {e}")
+        return
+
+    try:
+        cursor = connection.cursor(stream=True)
+        cursor.execute(_ADMIN_NOTES_QUERY)
+        for note in iter_records(cursor, batch_size, drain=False):
+            yield unpack_note(note)
+    except Error as e:
+        print(f"Ошибка при получении всех заметок: {e}")
+    finally:
+        # Закрытие соединения отбрасывает непрочитанный остаток, если клиент ушел
+        database.close_connection()
+
+
 def get_user_stats(user_email: str):
-    """Возвращает статистику пользователя"""
+    """Возвращает количество заметок пользователя из счетчика users.note_count"""
     connection = db.get_connection()
-    if not connection:
-        return 0
 
     try:
         cursor = connection.cursor()
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM notes n 
-            JOIN users u ON n.user_id = u.id 
-            WHERE u.email = %s
-        """, (user_email,))
+        cursor.execute("SELECT note_count FROM users WHERE email = %s", (user_email,))
         result = cursor.fetchone()
         return result[0] if result else 0
     except Error as e:
@@ -465,10 +858,13 @@ def get_user_stats(user_email: str):
         cursor.close()
 
 
+@migration
 def create_default_admin():
     """Создает администратора по умолчанию если его нет"""
-    connection = db.get_connection()
-    if not connection:
+    try:
+        connection = db.get_connection()
+    except DatabaseUnavailable as e:
+        print(f"Ошибка при создании администратора: {e}")
         return
 
     try:
@@ -492,5 +888,37 @@ def create_default_admin():
         cursor.close()
 
 
-# Создаем администратора при импорте
-create_default_admin()
\ No newline at end of file
+@migration
+def ensure_note_counters():
+    """Добавляет счетчик заметок пользователя и индекс для постраничного списка"""
+    if ensure_column('users', 'note_count', 'INT NOT NULL DEFAULT 0'):
+        # Счетчики заполняет фоновая задача порциями по пользователям, а не один
+        # UPDATE по всей таблице users. Если постановка не удалась, задачу все равно
+        # поставит расписание исполнителя (JobRunner.periodic)
+        connection = db.get_connection()
+        cursor = connection.cursor()
+        try:
+            enqueue_job(cursor, 0, 'reconcile_note_counts')
+            connection.commit()
+        finally:
+            cursor.close()
+    ensure_index('notes', 'idx_notes_user_updated', 'user_id, updated_at')
+
+
+@migration
+def ensure_note_versions():
+    """Добавляет номер версии заметки для условных (PATCH) обновлений"""
+    ensure_column('notes', 'version', 'INT NOT NULL DEFAULT 1')
+
+
+@migration
+def ensure_note_compression():
+    """Добавляет столбец для сжатого текста больших заметок"""
+    ensure_column('notes', 'content_packed', 'MEDIUMBLOB NULL')
+
+
+@migration
+def ensure_directory_indexes():
+    """Индексы для постраничного каталога пользователей"""
+    ensure_index('users', 'idx_users_created', 'created_at, id')
+    ensure_index('users', 'idx_users_name', 'name, id')
\ No newline at end of file
@@ -4,8 +4,6 @@ from database import db
 
 def test_encoding():
     connection = db.get_connection()
-    if not connection:
-        return
 
     cursor = connection.cursor(dictionary=True)
 
@@ -0,0 +1,65 @@
+# deltas.py
+
+
+class DeltaError(ValueError):
+    """Некорректный набор правок текста"""
+
+
+class VersionConflict(Exception):
+    """Заметка изменилась после версии, к которой относятся правки"""
+
+    def __init__(self, current_version: int):
+        super().__init__("Заметка была изменена, обновите страницу")
+        self.current_version = current_version
+
+
+def apply_ops(text: str, ops) -> str:
+    """Применяет правки к тексту
+
+    Каждая правка - (start, end, text): заменить text[start:end] новым текстом.
+    Позиции отсчитываются в символах исходного текста, правки не пересекаются.
+    """
+    parts = []
+    position = 0
+    for start, end, replacement in sorted(ops, key=lambda op: (op[0], op[1])):
+        if start < position or end < start or end > len(text):
+            raise DeltaError(f"Некорректный диапазон правки: {start}..{end}")
+        parts.append(text[position:start])
+        parts.append(replacement)
+        position = end
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def _common_prefix(a: str, b: str, limit: int, block: int = 1024) -> int:
+    # Сначала сравниваем блоками (срезы сравниваются в C), затем посимвольно
+    length = 0
+    while length + block <= limit and a[length:length + block] == b[length:length + block]:
+        length += block
+    while length < limit and a[length] == b[length]:
+        length += 1
+    return length
+
+
+def _common_suffix(a: str, b: str, limit: int, block: int = 1024) -> int:
+    length = 0
+    end_a, end_b = len(a), len(b)
+    while length + block <= limit and a[end_a - length - block:end_a - length] == b[end_b - length - block:end_b - length]:
+        length += block
+    while length < limit and a[-1 - length] == b[-1 - length]:
+        length += 1
+    return length
+
+
+def diff_ops(old: str, new: str):
+    """Правки, превращающие old в new: один диапазон между общими началом и концом
+
+    Обычное редактирование меняет одно место текста, поэтому такой разницы
+    достаточно, а считается она за один проход.
+    """
+    limit = min(len(old), len(new))
+    prefix = _common_prefix(old, new, limit)
+    suffix = _common_suffix(old, new, limit - prefix)
+    if prefix == len(old) and prefix == len(new):
+        return []
+    return [(prefix, len(old) - suffix, new[prefix:len(new) - suffix])]
@@ -0,0 +1,114 @@
+# events.py
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+try:
+    import redis
+except ImportError:  # Redis нужен только для рассылки между несколькими воркерами
+    redis = None
+
+
+class LocalBackend:
+    """Доставка событий подписчикам внутри одного процесса"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel: str, callback):
+        with self._lock:
+            self._subscribers[channel].add(callback)
+
+    def unsubscribe(self, channel: str, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(channel)
+            if callbacks:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self._subscribers[channel]
+
+    def publish(self, channel: str, event: dict):
+        self._deliver(channel, event)
+
+    def _deliver(self, channel: str, event: dict):
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, ()))
+        for callback in callbacks:
+            callback(event)
+
+
+class RedisBackend(LocalBackend):
+    """Рассылка событий через Redis pub/sub, чтобы их получали все воркеры"""
+
+    PREFIX = 'notes-events:'
+
+    def __init__(self, url: str = 'redis://127.0.0.1:6379/0'):
+        if redis is None:
+            raise RuntimeError("Для RedisBackend нужен пакет redis")
+        super().__init__()
+        self._client = redis.Redis.from_url(url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(f'{self.PREFIX}*')
+        self._thread = threading.Thread(target=self._listen, name='events-redis', daemon=True)
+        self._thread.start()
+
+    def publish(self, channel: str, event: dict):
+        self._client.publish(f'{self.PREFIX}{channel}', json.dumps(event))
+
+    def _listen(self):
+        for message in self._pubsub.listen():
+            channel = message['channel'].decode('utf-8')[len(self.PREFIX):]
+            self._deliver(channel, json.loads(message['data']))
+
+
+class EventBus:
+    """Публикация изменений заметок и их рассылка открытым вкладкам через SSE"""
+
+    def __init__(self, backend=None, queue_size: int = 100, heartbeat: float = 15.0):
+        self.backend = backend or LocalBackend()
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+
+    def publish(self, user_email: str, event_type: str, note_id: int = None):
+        """Сообщает подписчикам пользователя об изменении; безопасно вызывать из любого потока"""
+        self.backend.publish(user_email, {'type': event_type, 'note_id': note_id})
+
+    async def stream(self, user_email: str):
+        """Асинхронный генератор сообщений text/event-stream для пользователя"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+
+        def enqueue(event):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Отставший клиент теряет события и просто перезагружает список
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({'type': 'resync', 'note_id': None})
+
+        def deliver(event):
+            try:
+                loop.call_soon_threadsafe(enqueue, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт, подписчик вот-вот будет удален
+                pass
+
+        self.backend.subscribe(user_email, deliver)
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=self.heartbeat)
+                except asyncio.TimeoutError:
+                    # Комментарий не дает прокси закрыть простаивающее соединение
+                    yield ': ping\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.backend.unsubscribe(user_email, deliver)
+
+
+event_bus = EventBus()
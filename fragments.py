@@ -0,0 +1,64 @@
+# fragments.py
+import hashlib
+import sys
+import time
+
+from markupsafe import Markup
+
+from cache import ByteLRUCache
+
+NOTE_CARD = 'note_card.html'
+NOTE_CARD_LIST = 'note_card_list.html'
+
+
+class FragmentCache:
+    """Кэш отрендеренных карточек заметок
+
+    Карточка переиспользуется, пока у заметки те же updated_at и version, а у
+    шаблона та же версия (хэш исходника). Изменение шаблона на диске при auto_reload
+    дает новую версию, и старые карточки перестают совпадать.
+    """
+
+    def __init__(self, env, max_bytes: int = 16 * 1024 * 1024, template_check_interval: float = 1.0):
+        self.env = env
+        self.cache = ByteLRUCache(max_bytes)
+        self.template_check_interval = template_check_interval
+        self._templates = {}
+
+    def render(self, note, template_name: str = NOTE_CARD) -> Markup:
+        """Возвращает HTML карточки заметки, рендеря шаблон только при промахе"""
+        template = self._template(template_name)
+        key = (template_name, note['id'])
+        stamp = (note['updated_at'], note.get('version'), self._version(template))
+
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            return Markup(cached[1])
+
+        html = template.render(note=note)
+        self.cache.set(key, (stamp, html), sys.getsizeof(html))
+        return Markup(html)
+
+    def invalidate(self, note_id: int):
+        """Сбрасывает карточки заметки сразу после ее изменения"""
+        for template_name in (NOTE_CARD, NOTE_CARD_LIST):
+            self.cache.pop((template_name, note_id))
+
+    def _template(self, template_name: str):
+        # get_template при auto_reload проверяет файл на диске; для сотен карточек
+        # на странице достаточно делать это не чаще раза в template_check_interval
+        now = time.monotonic()
+        cached = self._templates.get(template_name)
+        if cached is not None and now - cached[1] < self.template_check_interval:
+            return cached[0]
+        template = self.env.get_template(template_name)
+        self._templates[template_name] = (template, now)
+        return template
+
+    def _version(self, template) -> str:
+        version = getattr(template, 'fragment_version', None)
+        if version is None:
+            source, _, _ = self.env.loader.get_source(self.env, template.name)
+            version = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+            template.fragment_version = version
+        return version
@@ -0,0 +1,383 @@
+# jobs.py
+import threading
+import time
+
+from mysql.connector import Error
+
+from compression import codec
+from database import db, Database, DatabaseUnavailable, CONNECTION_ERRORS
+from events import event_bus
+from revisions import KEEP_REVISIONS, prune_note
+from tags import release_note_tags
+from typeahead import title_index
+from schema import ensure_table, ensure_index, migration
+
+JOBS_TABLE = """
+    CREATE TABLE IF NOT EXISTS background_jobs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        job_type VARCHAR(50) NOT NULL,
+        status ENUM('pending', 'running', 'done', 'failed') NOT NULL DEFAULT 'pending',
+        position BIGINT NOT NULL DEFAULT 0,
+        processed INT NOT NULL DEFAULT 0,
+        total INT NULL,
+        error TEXT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        KEY idx_jobs_status (status, updated_at),
+        KEY idx_jobs_user (user_id, id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8
+"""
+
+# Обработчики задач: job_type -> (подсчет объема, обработка порции, действие после завершения)
+JOB_HANDLERS = {}
+
+
+def job_handler(job_type: str, count=None, on_done=None):
+    """Регистрирует обработчик порции для типа задачи"""
+    def register(func):
+        JOB_HANDLERS[job_type] = (count, func, on_done)
+        return func
+    return register
+
+
+def _count_notes(cursor, job):
+    cursor.execute("SELECT COUNT(*) FROM notes WHERE user_id = %s AND id <= %s",
+                   (job['user_id'], job['position']))
+    return cursor.fetchone()[0]
+
+
+def _notify_notes_cleared(cursor, job):
+    cursor.execute("SELECT email FROM users WHERE id = %s", (job['user_id'],))
+    user = cursor.fetchone()
+    if user:
+        title_index.forget(user[0])
+        event_bus.publish(user[0], 'cleared')
+
+
+@job_handler('delete_all_notes', count=_count_notes, on_done=_notify_notes_cleared)
+def _delete_notes_chunk(cursor, job, chunk_size: int):
+    """Удаляет очередную порцию заметок; position - максимальный id на момент постановки"""
+    cursor.execute(
+        "SELECT id FROM notes WHERE user_id = %s AND id <= %s ORDER BY id LIMIT %s FOR UPDATE",
+        (job['user_id'], job['position'], chunk_size)
+    )
+    note_ids = [row[0] for row in cursor.fetchall()]
+    deleted = 0
+    if note_ids:
+        # Счетчики тегов уменьшаются в той же транзакции, что и удаление порции
+        release_note_tags(cursor, note_ids)
+        cursor.execute(f"DELETE FROM notes WHERE id IN ({', '.join(['%s'] * len(note_ids))})", tuple(note_ids))
+        deleted = cursor.rowcount
+    if deleted:
+        cursor.execute(
+            "UPDATE users SET note_count = GREATEST(note_count - %s, 0) WHERE id = %s",
+            (deleted, job['user_id'])
+        )
+    if deleted < chunk_size:
+        cursor.execute(
+            "INSERT INTO user_activity (user_id, activity_type, description) VALUES (%s, %s, %s)",
+            (job['user_id'], 'delete_all_notes', 'Удалены все заметки')
+        )
+    return deleted, deleted < chunk_size
+
+
+@job_handler('reconcile_note_counts')
+def _reconcile_counts_chunk(cursor, job, chunk_size: int):
+    """Пересчитывает users.note_count и tags.note_count для очередного диапазона пользователей"""
+    cursor.execute("SELECT id FROM users WHERE id > %s ORDER BY id LIMIT %s", (job['position'], chunk_size))
+    user_ids = [row[0] for row in cursor.fetchall()]
+    if not user_ids:
+        return 0, True
+
+    cursor.execute("""
+        UPDATE users u
+        SET note_count = (SELECT COUNT(*) FROM notes n WHERE n.user_id = u.id)
+        WHERE u.id BETWEEN %s AND %s
+    """, (user_ids[0], user_ids[-1]))
+    cursor.execute("""
+        UPDATE tags t
+        SET note_count = (SELECT COUNT(*) FROM note_tags nt WHERE nt.tag_id = t.id)
+        WHERE t.user_id BETWEEN %s AND %s
+    """, (user_ids[0], user_ids[-1]))
+    job['position'] = user_ids[-1]
+    return len(user_ids), len(user_ids) < chunk_size
+
+
+def _count_uncompressed(cursor, job):
+    cursor.execute(
+        "SELECT COUNT(*) FROM notes WHERE id > %s AND content_packed IS NULL AND LENGTH(content) >= %s",
+        (job['position'], codec.threshold)
+    )
+    return cursor.fetchone()[0]
+
+
+@job_handler('compress_notes', count=_count_uncompressed)
+def _compress_notes_chunk(cursor, job, chunk_size: int):
+    """Сжимает очередную порцию больших несжатых заметок по возрастанию id"""
+    cursor.execute("""
+        SELECT id, content, version FROM notes
+        WHERE id > %s AND content_packed IS NULL AND LENGTH(content) >= %s
+        ORDER BY id LIMIT %s
+    """, (job['position'], codec.threshold, chunk_size))
+    rows = cursor.fetchall()
+    for note_id, content, version in rows:
+        packed = codec.pack(content)
+        if packed is None:
+            continue
+        # Текст не меняется, поэтому version и updated_at остаются прежними;
+        # заметку, измененную после чтения, пропускаем - ее уже сохранил новый код
+        cursor.execute("""
+            UPDATE notes SET content = '', content_packed = %s, updated_at = updated_at
+            WHERE id = %s AND version = %s AND content_packed IS NULL
+        """, (packed, note_id, version))
+    if rows:
+        job['position'] = rows[-1][0]
+    return len(rows), len(rows) < chunk_size
+
+
+@job_handler('prune_revisions')
+def _prune_revisions_chunk(cursor, job, chunk_size: int):
+    """Обрезает историю версий для очередного диапазона заметок
+
+    Заодно удаляет историю заметок, стертых массовым удалением.
+    """
+    cursor.execute("""
+        SELECT note_id, COUNT(*) FROM note_revisions
+        WHERE note_id > %s
+        GROUP BY note_id ORDER BY note_id LIMIT %s
+    """, (job['position'], chunk_size))
+    rows = cursor.fetchall()
+    if not rows:
+        return 0, True
+
+    cursor.execute("""
+        DELETE r FROM note_revisions r
+        LEFT JOIN notes n ON n.id = r.note_id
+        WHERE r.note_id BETWEEN %s AND %s AND n.id IS NULL
+    """, (rows[0][0], rows[-1][0]))
+    for note_id, count in rows:
+        if count > KEEP_REVISIONS:
+            prune_note(cursor, note_id)
+    job['position'] = rows[-1][0]
+    return len(rows), len(rows) < chunk_size
+
+
+def enqueue_job(cursor, user_id: int, job_type: str, position: int = 0):
+    """Ставит задачу в очередь в рамках транзакции вызывающего кода
+
+    Для системных задач user_id равен 0.
+    """
+    cursor.execute(
+        "INSERT INTO background_jobs (user_id, job_type, position) VALUES (%s, %s, %s)",
+        (user_id, job_type, position)
+    )
+    return cursor.lastrowid
+
+
+def get_job(job_id: int, user_email: str = None):
+    """Возвращает задачу; если указан email, то только задачу этого пользователя"""
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        query = """
+            SELECT j.id, j.job_type, j.status, j.processed, j.total, j.error, j.created_at, j.updated_at
+            FROM background_jobs j
+            LEFT JOIN users u ON j.user_id = u.id
+            WHERE j.id = %s
+        """
+        params = (job_id,)
+        if user_email is not None:
+            query += " AND u.email = %s"
+            params = (job_id, user_email)
+        cursor.execute(query, params)
+        return cursor.fetchone()
+    except Error as e:
+        print(f"Ошибка при получении задачи: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+class JobRunner:
+    """Фоновый исполнитель задач, обрабатывающий их короткими транзакциями"""
+
+    def __init__(self, chunk_size: int = 500, pause: float = 0.1,
+                 poll_interval: float = 5.0, stale_after: int = 60):
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        # Периодические системные задачи: job_type -> интервал в секундах
+        self.periodic = {'reconcile_note_counts': 3600, 'prune_revisions': 86400}
+        self._next_schedule_check = 0.0
+        # У исполнителя свое соединение, чтобы не делить его с потоками запросов
+        self.database = Database()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='job-runner', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def notify(self):
+        """Будит исполнителя после постановки новой задачи"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._schedule_periodic()
+                job = self._claim_next()
+                if job:
+                    self._process(job)
+                    continue
+            except DatabaseUnavailable as e:
+                self._stop.wait(max(e.retry_after, self.poll_interval))
+                continue
+            except Error as e:
+                print(f"Ошибка фоновой задачи: {e}")
+            except Exception as e:
+                # Любая ошибка не должна останавливать поток исполнителя
+                print(f"Ошибка фоновой задачи: {type(e).__name__}: {e}")
+
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _schedule_periodic(self):
+        """Ставит периодические задачи, если с прошлого запуска прошел интервал"""
+        if time.monotonic() < self._next_schedule_check:
+            return
+        self._next_schedule_check = time.monotonic() + self.poll_interval * 12
+
+        connection = self.database.get_connection()
+        cursor = connection.cursor()
+        try:
+            for job_type, interval in self.periodic.items():
+                # Расписание хранится в самой таблице задач, поэтому общее для всех процессов
+                cursor.execute("""
+                    SELECT COUNT(*) FROM background_jobs
+                    WHERE job_type = %s
+                      AND (status IN ('pending', 'running') OR created_at > NOW() - INTERVAL %s SECOND)
+                """, (job_type, interval))
+                if cursor.fetchone()[0] == 0:
+                    enqueue_job(cursor, 0, job_type)
+            connection.commit()
+        finally:
+            cursor.close()
+
+    def _claim_next(self):
+        """Забирает следующую задачу, включая зависшие после перезапуска"""
+        connection = self.database.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                SELECT id, user_id, job_type, position, processed, total
+                FROM background_jobs
+                WHERE status = 'pending'
+                   OR (status = 'running' AND updated_at < NOW() - INTERVAL %s SECOND)
+                ORDER BY id
+                LIMIT 1
+            """, (self.stale_after,))
+            rows = cursor.fetchall()
+            if not rows:
+                connection.commit()
+                return None
+
+            # Захват условным UPDATE, чтобы задачу не взяли два процесса
+            job = rows[0]
+            cursor.execute("""
+                UPDATE background_jobs SET status = 'running', updated_at = NOW()
+                WHERE id = %s AND (status = 'pending'
+                   OR (status = 'running' AND updated_at < NOW() - INTERVAL %s SECOND))
+            """, (job['id'], self.stale_after))
+            claimed = cursor.rowcount > 0
+            connection.commit()
+            return job if claimed else None
+        finally:
+            cursor.close()
+
+    def _process(self, job):
+        if job['job_type'] not in JOB_HANDLERS:
+            self._fail(job, f"Неизвестный тип задачи: {job['job_type']}")
+            return
+        count, handler, on_done = JOB_HANDLERS[job['job_type']]
+
+        connection = self.database.get_connection()
+        cursor = connection.cursor()
+        try:
+            if job['total'] is None and count:
+                job['total'] = count(cursor, job)
+                cursor.execute("UPDATE background_jobs SET total = %s WHERE id = %s", (job['total'], job['id']))
+                connection.commit()
+
+            done = False
+            while not done and not self._stop.is_set():
+                # Каждая порция и прогресс задачи фиксируются одной короткой транзакцией
+                processed, done = handler(cursor, job, self.chunk_size)
+                job['processed'] += processed
+                cursor.execute(
+                    "UPDATE background_jobs SET processed = %s, position = %s, status = %s WHERE id = %s",
+                    (job['processed'], job['position'], 'done' if done else 'running', job['id'])
+                )
+                connection.commit()
+                if not done:
+                    time.sleep(self.pause)
+
+            if done and on_done:
+                try:
+                    on_done(cursor, job)
+                except Exception as e:
+                    # Задача уже выполнена, ошибка уведомления ее не отменяет
+                    print(f"Ошибка после завершения задачи #{job['id']}: {type(e).__name__}: {e}")
+        except Error as e:
+            if e.errno in CONNECTION_ERRORS:
+                # Задача останется в статусе running и будет подхвачена повторно
+                raise
+            self._rollback(connection)
+            self._fail(job, str(e))
+        except Exception as e:
+            # Ошибка в коде обработчика: без отметки failed задачу снова взяли бы после перезапуска
+            self._rollback(connection)
+            self._fail(job, f"{type(e).__name__}: {e}")
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _rollback(connection):
+        try:
+            connection.rollback()
+        except Error:
+            pass
+
+    def _fail(self, job, message: str):
+        print(f"Ошибка фоновой задачи #{job['id']}: {message}")
+        connection = self.database.get_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute("UPDATE background_jobs SET status = 'failed', error = %s WHERE id = %s",
+                           (message, job['id']))
+            connection.commit()
+        finally:
+            cursor.close()
+
+
+@migration
+def ensure_jobs_table():
+    """Таблица фоновых задач и индекс для расписания периодических задач"""
+    ensure_table(JOBS_TABLE)
+    ensure_index('background_jobs', 'idx_jobs_type', 'job_type, created_at')
+
+
+job_runner = JobRunner()
@@ -1,26 +1,44 @@
-from fastapi import FastAPI, HTTPException, Request, Form, Depends
+from fastapi import FastAPI, HTTPException, Request, Form, Depends, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi import Cookie
-from typing import Optional
+from typing import List, Optional
+import math
 import time
 import secrets
 
-from db_operations impopip install python 3.11rt (
+from db_operations import (
     get_all_users, create_user_note, get_user_notes, delete_user_note,
     delete_all_user_notes, update_user_note, get_note_by_id, get_user_stats,
-    authenticate_user, create_user, is_admin, get_admin_stats, get_all_notes_admin,
-    get_user_activity, get_recent_activity
+    authenticate_user, create_user, is_admin, get_admin_stats,
+    get_user_activity, get_recent_activity, iter_all_notes_admin,
+    get_users_directory, count_users, patch_user_note, compress_existing_notes,
+    get_note_revisions, get_note_revision, restore_note_revision,
+    set_user_note_tags, get_user_tags, get_notes_by_tags
 )
-from models import UserRegister, UserLogin
+from jobs import job_runner, get_job
+from events import event_bus
+from typeahead import title_index
+from fragments import FragmentCache
+from database import DatabaseUnavailable
+from schema import run_migrations
+from deltas import DeltaError, VersionConflict
+from tags import normalize_tags
+from models import UserRegister, UserLogin, NotePatch
+from slow_query import slow_query_log, current_route
+from admission import AdmissionController, AdmissionMiddleware, RouteClass
+from templating import enable_bytecode_cache, warm_up, StreamingTemplateResponse
 
 app = FastAPI()
 
 templates = Jinja2Templates(directory='templates')
+enable_bytecode_cache(templates.env)
 app.mount('/static', StaticFiles(directory='static'), name='static')
 
 CSS_VERSION = str(int(time.time()))
+NOTES_PAGE_SIZE = 50
+USERS_PAGE_SIZE = 50
 
 
 def truncate_filter(s, length=100):
@@ -32,6 +50,77 @@ def truncate_filter(s, length=100):
 templates.env.filters["truncate"] = truncate_filter
 templates.env.globals["CSS_VERSION"] = CSS_VERSION
 
+fragments = FragmentCache(templates.env)
+templates.env.globals["note_card"] = fragments.render
+
+
+@app.middleware("http")
+async def track_route(request: Request, call_next):
+    # Маршрут нужен журналу медленных запросов
+    token = current_route.set(f"{request.method} {request.url.path}")
+    try:
+        return await call_next(request)
+    finally:
+        current_route.reset(token)
+
+
+# Классы маршрутов: дешевое чтение важнее записи, входа (bcrypt), админки и массовых операций
+admission = AdmissionController(
+    classes=[
+        RouteClass('core', limit=24, queue=48, priority=0, max_wait=1.0),
+        RouteClass('write', limit=12, queue=24, priority=1, max_wait=2.0),
+        RouteClass('auth', limit=4, queue=16, priority=2, max_wait=3.0),
+        RouteClass('bulk', limit=2, queue=4, priority=3, max_wait=2.0),
+        RouteClass('admin', limit=2, queue=4, priority=3, max_wait=5.0),
+        # SSE держит соединение долго и не занимает поток, поэтому лимит отдельный
+        RouteClass('stream', limit=500, shared=False),
+    ],
+    routes=[
+        (None, r'/static/.*', None),
+        ({'GET'}, r'/notes/events', 'stream'),
+        ({'POST'}, r'/(login|register)/?', 'auth'),
+        (None, r'/admin(/.*)?', 'admin'),
+        ({'POST'}, r'/notes/delete', 'bulk'),
+        ({'POST', 'PATCH'}, r'/notes.*', 'write'),
+    ],
+    default='core',
+    total=40
+)
+# Добавлен последним, значит внешний: лишние запросы отсекаются до остальных middleware
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
+
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable(request: Request, exc: DatabaseUnavailable):
+    # Пока цепь разомкнута, отвечаем сразу, не дожидаясь таймаута подключения
+    return JSONResponse(
+        status_code=503,
+        content={'detail': str(exc)},
+        headers={'Retry-After': str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+
+@app.on_event("startup")
+def apply_migrations():
+    # Выполняется первым: исполнителю задач и запросам нужна полная схема
+    run_migrations()
+
+
+@app.on_event("startup")
+def start_background_jobs():
+    job_runner.start()
+
+
+@app.on_event("startup")
+def warm_up_templates():
+    warm_up(templates.env)
+
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    job_runner.stop()
+
+
 sessions = {}
 
 
@@ -63,24 +152,41 @@ def delete_session(session_token: str):
         del sessions[session_token]
 
 
+def note_changed(user_email: str, event_type: str, note_id: int = None):
+    """Сбрасывает кэш карточки и сообщает открытым вкладкам об изменении заметки"""
+    if note_id is not None:
+        fragments.invalidate(note_id)
+    event_bus.publish(user_email, event_type, note_id)
+
+
 @app.get('/home', response_class=HTMLResponse)
 def home(request: Request,
+         page: int = 1,
          current_user: str = Depends(get_current_user),
          current_role: str = Depends(get_current_user_role)):
     if not current_user:
         return RedirectResponse(url='/authorization')
 
-    user_notes = get_user_notes(current_user)
+    notes_count = get_user_stats(current_user)
+    pages = max(1, math.ceil(notes_count / NOTES_PAGE_SIZE))
+    page = min(max(page, 1), pages)
+    user_notes = get_user_notes(current_user, compact=True,
+                                limit=NOTES_PAGE_SIZE, offset=(page - 1) * NOTES_PAGE_SIZE)
 
     user_activity = []
     if current_role == 'admin':
-        user_activity = get_user_activity(current_user, 5)
+        user_activity = get_user_activity(current_user, 5, compact=True)
 
-    return templates.TemplateResponse(
+    # Страница отправляется по мере рендеринга, шапка уходит до списка заметок
+    return StreamingTemplateResponse(
+        templates,
         "index.html",
         {
             'request': request,
             'notes': user_notes,
+            'notes_count': notes_count,
+            'page': page,
+            'pages': pages,
             'current_user': current_user,
             'current_role': current_role,
             'user_activity': user_activity
@@ -98,11 +204,13 @@ def admin_panel(
         raise HTTPException(status_code=403, detail="Доступ запрещен")
 
     stats = get_admin_stats()
-    all_users = get_all_users()
-    recent_activity = get_recent_activity(20)
-    all_notes = get_all_notes_admin()
+    all_users = get_all_users(compact=True)
+    recent_activity = get_recent_activity(20, compact=True)
+    # Заметки читаются порциями во время рендеринга, а не целиком заранее
+    all_notes = iter_all_notes_admin()
 
-    return templates.TemplateResponse(
+    return StreamingTemplateResponse(
+        templates,
         "admin.html",
         {
             'request': request,
@@ -116,17 +224,63 @@ def admin_panel(
     )
 
 
+@app.get('/admin/slow-queries')
+def admin_slow_queries(
+        current_user: str = Depends(get_current_user),
+        current_role: str = Depends(get_current_user_role)
+):
+    if not current_user or current_role != 'admin':
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+
+    return {
+        'threshold_ms': slow_query_log.threshold_ms,
+        'queries': slow_query_log.entries()
+    }
+
+
+@app.get('/admin/admission')
+def admin_admission(
+        current_user: str = Depends(get_current_user),
+        current_role: str = Depends(get_current_user_role)
+):
+    if not current_user or current_role != 'admin':
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+
+    return admission.metrics()
+
+
+@app.post('/admin/compress-notes')
+def admin_compress_notes(
+        current_user: str = Depends(get_current_user),
+        current_role: str = Depends(get_current_user_role)
+):
+    if not current_user or current_role != 'admin':
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+
+    job_id = compress_existing_notes()
+    if not job_id:
+        raise HTTPException(status_code=500, detail="Ошибка при постановке задачи")
+    return {'job_id': job_id}
+
+
 @app.post('/notes/create')
 def create_note(
         title: str = Form(...),
         content: str = Form(...),
+        tags: str = Form(''),
         current_user: str = Depends(get_current_user)
 ):
     if not current_user:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
 
-    note_id = create_user_note(title, content, current_user)
+    try:
+        tags = normalize_tags(tags)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    note_id = create_user_note(title, content, current_user, tags)
     if note_id:
+        note_changed(current_user, 'created', note_id)
         return RedirectResponse(url='/home', status_code=303)
     else:
         raise HTTPException(status_code=500, detail="Ошибка при создании заметки")
@@ -141,6 +295,7 @@ def delete_note_id(
         raise HTTPException(status_code=401, detail="Требуется авторизация")
 
     if delete_user_note(note_id, current_user):
+        note_changed(current_user, 'deleted', note_id)
         return RedirectResponse(url='/home', status_code=303)
     else:
         raise HTTPException(status_code=404, detail='Заметка не найдена')
@@ -155,6 +310,7 @@ def delete_note(
         raise HTTPException(status_code=401, detail="Требуется авторизация")
 
     if delete_user_note(note_id, current_user):
+        note_changed(current_user, 'deleted', note_id)
         return RedirectResponse(url='/home', status_code=303)
     else:
         raise HTTPException(status_code=404, detail='Заметка не найдена')
@@ -165,12 +321,28 @@ def delete_notes(current_user: str = Depends(get_current_user)):
     if not current_user:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
 
-    if delete_all_user_notes(current_user):
-        return RedirectResponse(url='/home', status_code=303)
+    job_id = delete_all_user_notes(current_user)
+    if job_id:
+        return RedirectResponse(url=f'/home?job={job_id}', status_code=303)
     else:
         raise HTTPException(status_code=500, detail="Ошибка при удалении заметок")
 
 
+@app.get('/jobs/{job_id}')
+def job_status(
+        job_id: int,
+        current_user: str = Depends(get_current_user),
+        current_role: str = Depends(get_current_user_role)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    job = get_job(job_id, None if current_role == 'admin' else current_user)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Задача не найдена')
+    return job
+
+
 @app.post('/notes/update_ID')
 def update_note_id(
         note_id: int = Form(...),
@@ -182,6 +354,7 @@ def update_note_id(
         raise HTTPException(status_code=401, detail="Требуется авторизация")
 
     if update_user_note(note_id, title, content, current_user):
+        note_changed(current_user, 'updated', note_id)
         return RedirectResponse(url='/home', status_code=303)
     else:
         raise HTTPException(status_code=404, detail='Заметка не найдена')
@@ -198,11 +371,166 @@ def update_note_route(
         raise HTTPException(status_code=401, detail="Требуется авторизация")
 
     if update_user_note(note_id, title, content, current_user):
+        note_changed(current_user, 'updated', note_id)
         return RedirectResponse(url='/home', status_code=303)
     else:
         raise HTTPException(status_code=404, detail='Заметка не найдена')
 
 
+@app.get('/notes/events')
+async def note_events(current_user: str = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    return StreamingResponse(
+        event_bus.stream(current_user),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.get('/notes/{note_id}/card', response_class=HTMLResponse)
+def note_card(note_id: int, request: Request, current_user: str = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    note = get_note_by_id(note_id, current_user)
+    if note is None:
+        raise HTTPException(status_code=404, detail='Заметка не найдена')
+
+    return HTMLResponse(fragments.render(note))
+
+
+@app.get('/notes/cards')
+def note_cards(page: int = 1, current_user: str = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    notes_count = get_user_stats(current_user)
+    pages = max(1, math.ceil(notes_count / NOTES_PAGE_SIZE))
+    page = min(max(page, 1), pages)
+    notes = get_user_notes(current_user, compact=True,
+                           limit=NOTES_PAGE_SIZE, offset=(page - 1) * NOTES_PAGE_SIZE)
+    return {
+        'page': page,
+        'pages': pages,
+        'cards': [{'id': note.id, 'html': fragments.render(note)} for note in notes]
+    }
+
+
+@app.patch('/notes/{note_id}')
+def patch_note(
+        note_id: int,
+        patch: NotePatch,
+        current_user: str = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    ops = [(op.start, op.end, op.text) for op in patch.ops]
+    try:
+        version = patch_user_note(note_id, current_user, patch.base_version, patch.base_length, ops, patch.title)
+    except VersionConflict as e:
+        return JSONResponse(status_code=409, content={'detail': str(e), 'version': e.current_version})
+    except DeltaError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if version is None:
+        raise HTTPException(status_code=404, detail='Заметка не найдена')
+
+    note_changed(current_user, 'updated', note_id)
+    return {'id': note_id, 'version': version}
+
+
+@app.get('/notes/typeahead')
+def notes_typeahead(q: str, limit: int = 10, current_user: str = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    if not q:
+        return []
+    return title_index.search(current_user, q, min(max(limit, 1), 50))
+
+
+@app.get('/tags')
+def user_tags(current_user: str = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    return get_user_tags(current_user)
+
+
+@app.get('/notes/tagged')
+def notes_by_tags(
+        tag: List[str] = Query(...),
+        before: Optional[int] = None,
+        current_user: str = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    try:
+        notes, next_cursor = get_notes_by_tags(current_user, normalize_tags(tag), before, NOTES_PAGE_SIZE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {'notes': [note._asdict() for note in notes], 'next': next_cursor}
+
+
+@app.post('/notes/{note_id}/tags')
+def update_note_tags(
+        note_id: int,
+        tags: str = Form(''),
+        current_user: str = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    try:
+        tags = normalize_tags(tags)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    result = set_user_note_tags(note_id, current_user, tags)
+    if result is None:
+        raise HTTPException(status_code=404, detail='Заметка не найдена')
+    return {'id': note_id, 'tags': result}
+
+
+@app.get('/notes/{note_id}/revisions')
+def note_revisions(note_id: int, current_user: str = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    revisions = get_note_revisions(note_id, current_user)
+    if revisions is None:
+        raise HTTPException(status_code=404, detail='Заметка не найдена')
+    return revisions
+
+
+@app.get('/notes/{note_id}/revisions/{version}')
+def note_revision(note_id: int, version: int, current_user: str = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    revision = get_note_revision(note_id, current_user, version)
+    if revision is None:
+        raise HTTPException(status_code=404, detail='Версия не найдена')
+    return revision
+
+
+@app.post('/notes/{note_id}/revisions/{version}/restore')
+def restore_revision(note_id: int, version: int, current_user: str = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+
+    if restore_note_revision(note_id, current_user, version):
+        note_changed(current_user, 'updated', note_id)
+        return RedirectResponse(url='/home', status_code=303)
+    else:
+        raise HTTPException(status_code=404, detail='Версия не найдена')
+
+
 @app.get('/', response_class=HTMLResponse)
 def register(request: Request):
     return templates.TemplateResponse('register.html', {'request': request})
@@ -227,7 +555,7 @@ def get_notes(request: Request, current_user: str = Depends(get_current_user)):
     if not current_user:
         return RedirectResponse(url='/authorization')
 
-    user_notes = get_user_notes(current_user)
+    user_notes = get_user_notes(current_user, compact=True)
     return templates.TemplateResponse('index2.html', {'request': request, 'notes': user_notes})
 
 
@@ -273,32 +601,34 @@ def get_len_notes(request: Request, current_user: str = Depends(get_current_user
 @app.get('/users', response_class=HTMLResponse)
 def get_users(
         request: Request,
+        sort: str = 'newest',
+        after: Optional[str] = None,
         current_user: str = Depends(get_current_user),
         current_role: str = Depends(get_current_user_role)
 ):
     if not current_user:
         return RedirectResponse(url='/authorization')
 
-    if current_role == 'admin':
-        users = get_all_users()
-    else:
-        users = get_all_users()
-        for user in users:
-            user['last_login'] = None
-            user['email'] = user['email'].split('@')[0] + '@***'
+    try:
+        users, next_cursor = get_users_directory(current_role, sort, after, USERS_PAGE_SIZE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return templates.TemplateResponse(
         'users.html',
         {
             'request': request,
             'users': users,
+            'total_users': count_users(),
+            'sort': sort,
+            'next_cursor': next_cursor,
             'current_role': current_role
         }
     )
 
 
 @app.post("/login/")
-async def login_user(
+def login_user(
         request: Request,
         email: str = Form(...),
         password: str = Form(...)
@@ -324,7 +654,7 @@ async def login_user(
 
 
 @app.post("/register/")
-async def register_user(
+def register_user(
         request: Request,
         name: str = Form(...),
         email: str = Form(...),
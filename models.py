@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -33,6 +33,7 @@ class Note(BaseModel):
     title: str
     content: str
     user_id: int
+    version: int
     created_at: datetime
     updated_at: datetime
 
@@ -40,6 +41,18 @@ class NoteUpdate(BaseModel):
     title: str
     content: str
 
+class TextOp(BaseModel):
+    start: int
+    end: int
+    text: str = ''
+
+class NotePatch(BaseModel):
+    base_version: int
+    # Длина текста (в символах, переводы строк - \n), к которому относятся правки
+    base_length: int
+    title: Optional[str] = None
+    ops: List[TextOp] = []
+
 class UserActivity(BaseModel):
     id: int
     user_id: int
@@ -0,0 +1,67 @@
+# records.py
+from collections import namedtuple
+from functools import lru_cache
+
+
+@lru_cache(maxsize=128)
+def record_type(columns: tuple):
+    """Возвращает компактный тип строки для набора столбцов
+
+    Строка хранится как кортеж без собственного словаря: доступ по атрибуту
+    (note.title, как в шаблонах) и по имени столбца (note['title']).
+    """
+    base = namedtuple('Record', columns, rename=True)
+
+    class Record(base):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                try:
+                    return getattr(self, key)
+                except AttributeError:
+                    raise KeyError(key) from None
+            return tuple.__getitem__(self, key)
+
+        def get(self, key, default=None):
+            return getattr(self, key, default)
+
+        def keys(self):
+            return self._fields
+
+    return Record
+
+
+def _cursor_record_type(cursor):
+    return record_type(tuple(cursor.column_names))
+
+
+def fetch_records(cursor):
+    """Читает весь результат курсора в список компактных строк"""
+    make = _cursor_record_type(cursor)._make
+    return [make(row) for row in cursor.fetchall()]
+
+
+def iter_records(cursor, batch_size: int = 500, drain: bool = True):
+    """Лениво читает результат порциями; курсор закрывается после чтения
+
+    Курсор должен быть небуферизованным, тогда в памяти держится одна порция.
+    drain=False - не дочитывать остаток при досрочном выходе: вызывающий код
+    сам закроет соединение.
+    """
+    exhausted = False
+    try:
+        make = _cursor_record_type(cursor)._make
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                exhausted = True
+                break
+            for row in rows:
+                yield make(row)
+    finally:
+        if not exhausted and drain:
+            # Непрочитанный остаток не даст выполнить следующий запрос в этом соединении
+            cursor.fetchall()
+        if exhausted or drain:
+            cursor.close()
@@ -0,0 +1,145 @@
+# revisions.py
+import json
+
+from compression import codec
+from deltas import apply_ops, diff_ops
+from schema import ensure_table, migration
+
+REVISIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS note_revisions (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        note_id INT NOT NULL,
+        version INT NOT NULL,
+        kind ENUM('text', 'packed', 'delta') NOT NULL,
+        title VARCHAR(255) NOT NULL,
+        body MEDIUMBLOB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY idx_revisions_note (note_id, version)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8
+"""
+
+# Полный снимок пишется не реже чем раз в SNAPSHOT_INTERVAL версий, поэтому
+# для восстановления любой версии применяется не больше SNAPSHOT_INTERVAL - 1 правок
+SNAPSHOT_INTERVAL = 20
+# Сколько последних версий хранить для каждой заметки
+KEEP_REVISIONS = 100
+
+
+def _snapshot(text: str):
+    packed = codec.pack(text)
+    if packed is None:
+        return 'text', text.encode('utf-8')
+    return 'packed', packed
+
+
+def _insert(cursor, note_id: int, version: int, title: str, kind: str, body: bytes):
+    cursor.execute(
+        "INSERT INTO note_revisions (note_id, version, kind, title, body) VALUES (%s, %s, %s, %s, %s)",
+        (note_id, version, kind, title, body)
+    )
+
+
+def record_change(cursor, note_id: int, old_version: int, old_title: str, old_content: str,
+                  title: str, content: str, ops=None):
+    """Записывает версию old_version + 1 как правку относительно предыдущей
+
+    Вызывается в транзакции обновления заметки, пока строка заметки заблокирована.
+    ops - уже известные правки (PATCH), иначе они вычисляются по текстам.
+    Текущая версия хранится в notes, поэтому история появляется только с первой
+    правки: тогда же сохраняется снимок исходного текста.
+    """
+    # Блокирующее чтение видит последние зафиксированные версии, а не старый снимок транзакции
+    cursor.execute("""
+        SELECT MAX(version), MAX(CASE WHEN kind <> 'delta' THEN version END)
+        FROM note_revisions WHERE note_id = %s
+        FOR UPDATE
+    """, (note_id,))
+    last_version, last_snapshot = cursor.fetchone()
+
+    if last_version is None or last_version < old_version:
+        # Истории еще нет или в ней пропуск: добавляем снимок текста до правки,
+        # существующие версии не трогаем
+        _insert(cursor, note_id, old_version, old_title, *_snapshot(old_content))
+        last_snapshot = old_version
+
+    version = old_version + 1
+    if ops is None:
+        ops = diff_ops(old_content, content)
+    delta = json.dumps(ops, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    # Снимок, если цепочка правок стала длинной или правка сравнима с самим текстом
+    if (last_snapshot is None or version - last_snapshot >= SNAPSHOT_INTERVAL
+            or len(delta) * 2 > len(content.encode('utf-8'))):
+        _insert(cursor, note_id, version, title, *_snapshot(content))
+    else:
+        _insert(cursor, note_id, version, title, 'delta', delta)
+
+
+def list_revisions(cursor, note_id: int):
+    cursor.execute("""
+        SELECT version, kind, title, LENGTH(body) AS size, created_at
+        FROM note_revisions WHERE note_id = %s
+        ORDER BY version DESC
+    """, (note_id,))
+    return cursor.fetchall()
+
+
+def load_revision(cursor, note_id: int, version: int):
+    """Восстанавливает (title, content) версии: ближайший снимок плюс правки после него
+
+    Возвращает None, если такой версии нет в истории.
+    """
+    cursor.execute("""
+        SELECT version, kind, title, body FROM note_revisions
+        WHERE note_id = %s AND version <= %s AND version >= (
+            SELECT MAX(version) FROM note_revisions
+            WHERE note_id = %s AND version <= %s AND kind <> 'delta'
+        )
+        ORDER BY version
+    """, (note_id, version, note_id, version))
+    rows = cursor.fetchall()
+    if not rows or rows[-1][0] != version:
+        return None
+
+    title = content = None
+    for _, kind, title, body in rows:
+        body = bytes(body)
+        if kind == 'text':
+            content = body.decode('utf-8')
+        elif kind == 'packed':
+            content = codec.unpack(body)
+        else:
+            content = apply_ops(content, json.loads(body))
+    return title, content
+
+
+def prune_note(cursor, note_id: int, keep: int = KEEP_REVISIONS):
+    """Оставляет последние keep версий; самая старая из них превращается в снимок"""
+    cursor.execute("SELECT MAX(version) FROM note_revisions WHERE note_id = %s", (note_id,))
+    last_version = cursor.fetchone()[0]
+    if last_version is None:
+        return 0
+
+    oldest = last_version - keep + 1
+    cursor.execute("SELECT kind FROM note_revisions WHERE note_id = %s AND version = %s", (note_id, oldest))
+    row = cursor.fetchone()
+    if row is None:
+        return 0
+    if row[0] == 'delta':
+        revision = load_revision(cursor, note_id, oldest)
+        if revision is None:
+            # Цепочку до этой версии восстановить нельзя - ничего не удаляем
+            return 0
+        kind, body = _snapshot(revision[1])
+        cursor.execute(
+            "UPDATE note_revisions SET kind = %s, body = %s WHERE note_id = %s AND version = %s",
+            (kind, body, note_id, oldest)
+        )
+    cursor.execute("DELETE FROM note_revisions WHERE note_id = %s AND version < %s", (note_id, oldest))
+    return cursor.rowcount
+
+
+@migration
+def ensure_revisions_table():
+    """Таблица истории версий заметок"""
+    ensure_table(REVISIONS_TABLE)
@@ -0,0 +1,112 @@
+# schema.py
+import time
+
+from database import db, DatabaseUnavailable, CONNECTION_ERRORS
+from mysql.connector import Error, errorcode
+
+# Миграции в порядке регистрации; выполняются при старте приложения (run_migrations)
+MIGRATIONS = []
+
+
+class MigrationError(Exception):
+    """Схему базы данных не удалось привести к нужному виду"""
+
+
+def migration(func):
+    """Регистрирует идемпотентную функцию миграции"""
+    MIGRATIONS.append(func)
+    return func
+
+
+def run_migrations(attempts: int = 10, delay: float = 3.0):
+    """Выполняет все миграции; пока база недоступна, повторяет попытку
+
+    Миграции идемпотентны, поэтому каждая попытка проходит список с начала,
+    а воркеры, запущенные одновременно, могут выполнять их параллельно.
+    Если база так и не ответила или запрос схемы ошибочен, выбрасывает
+    MigrationError: приложение не должно стартовать с неполной схемой.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            for func in MIGRATIONS:
+                func()
+            print(f"✅ Схема базы данных актуальна ({len(MIGRATIONS)} миграций)")
+            return
+        except DatabaseUnavailable as e:
+            wait = max(delay, e.retry_after)
+            error = e
+        except Error as e:
+            if e.errno not in CONNECTION_ERRORS:
+                raise MigrationError(f"Ошибка миграции {func.__name__}: {e}") from e
+            wait = delay
+            error = e
+        print(f"Ошибка при изменении схемы (попытка {attempt} из {attempts}): {error}")
+        if attempt < attempts:
+            time.sleep(wait)
+    raise MigrationError(f"База данных недоступна, миграции не выполнены: {error}") from error
+
+
+# Функции ниже не перехватывают ошибки: их обрабатывает run_migrations
+
+
+def ensure_table(ddl: str):
+    """Создает таблицу, если ее еще нет (ddl должен содержать IF NOT EXISTS)"""
+    connection = db.get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(ddl)
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+def column_exists(cursor, table: str, column: str) -> bool:
+    cursor.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return bool(cursor.fetchall())
+
+
+def index_exists(cursor, table: str, index: str) -> bool:
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, index))
+    return bool(cursor.fetchall())
+
+
+def ensure_column(table: str, column: str, definition: str) -> bool:
+    """Добавляет столбец, если его нет; возвращает True, если столбец добавлен"""
+    connection = db.get_connection()
+    cursor = connection.cursor()
+    try:
+        if column_exists(cursor, table, column):
+            return False
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        connection.commit()
+        return True
+    except Error as e:
+        # Другой воркер успел добавить столбец между проверкой и ALTER
+        if e.errno == errorcode.ER_DUP_FIELDNAME:
+            return False
+        raise
+    finally:
+        cursor.close()
+
+
+def ensure_index(table: str, index: str, columns: str):
+    """Создает индекс, если его нет"""
+    connection = db.get_connection()
+    cursor = connection.cursor()
+    try:
+        if not index_exists(cursor, table, index):
+            cursor.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+            connection.commit()
+    except Error as e:
+        # Индекс уже создан другим воркером
+        if e.errno != errorcode.ER_DUP_KEYNAME:
+            raise
+    finally:
+        cursor.close()
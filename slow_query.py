@@ -0,0 +1,146 @@
+# slow_query.py
+import hashlib
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+# Маршрут текущего запроса (устанавливается middleware в main.py)
+current_route = ContextVar('current_route', default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def normalize_sql(sql: str) -> str:
+    """Приводит запрос к виду без литералов и лишних пробелов"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('(?+)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized_sql: str) -> str:
+    """Короткий отпечаток нормализованного запроса"""
+    return hashlib.sha1(normalized_sql.encode('utf-8')).hexdigest()[:16]
+
+
+def param_shape(params) -> list:
+    """Описывает параметры запроса без их значений"""
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {key: _value_shape(value) for key, value in params.items()}
+    return [_value_shape(value) for value in params]
+
+
+def _value_shape(value) -> str:
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}({len(value)})'
+    return type(value).__name__
+
+
+def calling_function() -> str:
+    """Находит функцию слоя данных, которая выполнила запрос"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module not in (__name__, 'database'):
+            return f'{module}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryLog:
+    """Журнал медленных запросов с EXPLAIN для первого появления каждого запроса"""
+
+    def __init__(self, threshold_ms: float = 200, capacity: int = 200, explain: bool = True):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.enabled = True
+        self._entries = deque(maxlen=capacity)
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def configure(self, threshold_ms: float = None, capacity: int = None,
+                  explain: bool = None, enabled: bool = None):
+        """Меняет настройки журнала во время работы"""
+        with self._lock:
+            if threshold_ms is not None:
+                self.threshold_ms = threshold_ms
+            if capacity is not None:
+                self._entries = deque(self._entries, maxlen=capacity)
+            if explain is not None:
+                self.explain = explain
+            if enabled is not None:
+                self.enabled = enabled
+
+    def observe(self, sql: str, params, duration: float, explain_runner=None, function: str = None):
+        """Записывает запрос, если он выполнялся дольше порога
+
+        function - функция, выполнившая запрос; определяется заранее, если
+        запрос завершается позже (при следующем execute() или close() курсора).
+        """
+        duration_ms = duration * 1000
+        if not self.enabled or duration_ms < self.threshold_ms:
+            return
+
+        normalized = normalize_sql(sql)
+        key = fingerprint(normalized)
+        entry = {
+            'fingerprint': key,
+            'sql': normalized,
+            'params': param_shape(params),
+            'function': function or calling_function(),
+            'route': current_route.get(),
+            'duration_ms': round(duration_ms, 2),
+            'recorded_at': time.time(),
+        }
+
+        run_explain = False
+        with self._lock:
+            self._entries.append(entry)
+            if key not in self._plans:
+                self._plans[key] = None
+                run_explain = (self.explain and explain_runner is not None
+                               and normalized.upper().startswith(_EXPLAINABLE))
+
+        # EXPLAIN выполняется в фоне, чтобы не задерживать и без того медленный запрос
+        if run_explain:
+            threading.Thread(
+                target=self._capture_plan,
+                args=(key, sql, params, explain_runner),
+                daemon=True
+            ).start()
+
+    def _capture_plan(self, key: str, sql: str, params, explain_runner):
+        try:
+            plan = explain_runner(sql, params)
+        except Exception as e:
+            plan = {'error': str(e)}
+        with self._lock:
+            self._plans[key] = plan
+
+    def entries(self):
+        """Возвращает записи журнала, начиная с самых свежих"""
+        with self._lock:
+            entries = list(self._entries)
+            plans = dict(self._plans)
+        return [dict(entry, explain=plans.get(entry['fingerprint'])) for entry in reversed(entries)]
+
+    def clear(self):
+        """Очищает журнал и сохраненные планы"""
+        with self._lock:
+            self._entries.clear()
+            self._plans.clear()
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,136 @@
+# tags.py
+from schema import ensure_table, migration
+
+TAGS_TABLE = """
+    CREATE TABLE IF NOT EXISTS tags (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        name VARCHAR(50) NOT NULL,
+        note_count INT NOT NULL DEFAULT 0,
+        UNIQUE KEY idx_tags_user_name (user_id, name)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8
+"""
+
+# Первичный ключ (tag_id, note_id) отдает заметки тега по убыванию id прямо из
+# индекса; обратный индекс нужен при удалении заметки и замене ее тегов
+NOTE_TAGS_TABLE = """
+    CREATE TABLE IF NOT EXISTS note_tags (
+        tag_id INT NOT NULL,
+        note_id INT NOT NULL,
+        PRIMARY KEY (tag_id, note_id),
+        KEY idx_note_tags_note (note_id, tag_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8
+"""
+
+MAX_TAGS_PER_NOTE = 20
+MAX_FILTER_TAGS = 5
+
+
+def normalize_tags(tags) -> list:
+    """Приводит теги к нижнему регистру, убирает пустые и повторы
+
+    Принимает строку через запятую или список строк.
+    """
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    result = []
+    for tag in tags:
+        tag = tag.strip().lower()[:50]
+        if tag and tag not in result:
+            result.append(tag)
+    if len(result) > MAX_TAGS_PER_NOTE:
+        raise ValueError(f"У заметки может быть не больше {MAX_TAGS_PER_NOTE} тегов")
+    return result
+
+
+def _placeholders(values) -> str:
+    return ', '.join(['%s'] * len(values))
+
+
+def set_note_tags(cursor, user_id: int, note_id: int, names: list):
+    """Заменяет теги заметки и поправляет счетчики тегов в транзакции вызывающего кода"""
+    cursor.execute("""
+        SELECT t.id, t.name FROM note_tags nt
+        JOIN tags t ON t.id = nt.tag_id
+        WHERE nt.note_id = %s
+    """, (note_id,))
+    current = {name: tag_id for tag_id, name in cursor.fetchall()}
+
+    removed = [tag_id for name, tag_id in current.items() if name not in names]
+    if removed:
+        cursor.execute(
+            f"DELETE FROM note_tags WHERE note_id = %s AND tag_id IN ({_placeholders(removed)})",
+            (note_id, *removed)
+        )
+        cursor.execute(
+            f"UPDATE tags SET note_count = GREATEST(note_count - 1, 0) WHERE id IN ({_placeholders(removed)})",
+            tuple(removed)
+        )
+
+    for name in names:
+        if name in current:
+            continue
+        # LAST_INSERT_ID(id) возвращает id уже существующего тега через lastrowid
+        cursor.execute("""
+            INSERT INTO tags (user_id, name, note_count) VALUES (%s, %s, 1)
+            ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), note_count = note_count + 1
+        """, (user_id, name))
+        cursor.execute("INSERT INTO note_tags (tag_id, note_id) VALUES (%s, %s)", (cursor.lastrowid, note_id))
+
+
+def release_note_tags(cursor, note_ids: list):
+    """Снимает теги с удаляемых заметок и уменьшает счетчики одним запросом на порцию"""
+    if not note_ids:
+        return
+    marks = _placeholders(note_ids)
+    cursor.execute(f"""
+        UPDATE tags t
+        JOIN (
+            SELECT tag_id, COUNT(*) AS removed FROM note_tags
+            WHERE note_id IN ({marks}) GROUP BY tag_id
+        ) r ON r.tag_id = t.id
+        SET t.note_count = GREATEST(t.note_count - r.removed, 0)
+    """, tuple(note_ids))
+    cursor.execute(f"DELETE FROM note_tags WHERE note_id IN ({marks})", tuple(note_ids))
+
+
+def get_note_tag_names(cursor, note_id: int) -> list:
+    cursor.execute("""
+        SELECT t.name FROM note_tags nt
+        JOIN tags t ON t.id = nt.tag_id
+        WHERE nt.note_id = %s
+        ORDER BY t.name
+    """, (note_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def tagged_notes_query(tag_ids: list, before: int = None):
+    """Запрос страницы заметок, у которых есть все теги из tag_ids
+
+    tag_ids отсортированы по возрастанию note_count: выборка идет по самому
+    редкому тегу, остальные проверяются точечным поиском по первичному ключу
+    note_tags, так что фильтр не выходит за индексы.
+    """
+    joins = ''.join(
+        f" JOIN note_tags t{i} ON t{i}.tag_id = %s AND t{i}.note_id = t0.note_id"
+        for i in range(1, len(tag_ids))
+    )
+    query = (
+        "SELECT STRAIGHT_JOIN n.id, n.title, n.created_at, n.updated_at"
+        f" FROM note_tags t0{joins}"
+        " JOIN notes n ON n.id = t0.note_id"
+        " WHERE t0.tag_id = %s"
+    )
+    params = [*tag_ids[1:], tag_ids[0]]
+    if before is not None:
+        query += " AND t0.note_id < %s"
+        params.append(before)
+    query += " ORDER BY t0.note_id DESC LIMIT %s"
+    return query, params
+
+
+@migration
+def ensure_tag_tables():
+    """Таблицы тегов и связей заметок с тегами"""
+    ensure_table(TAGS_TABLE)
+    ensure_table(NOTE_TAGS_TABLE)
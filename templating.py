@@ -0,0 +1,70 @@
+# templating.py
+import time
+
+from jinja2 import FileSystemBytecodeCache
+from starlette.responses import StreamingResponse
+
+
+def enable_bytecode_cache(env, directory: str = None):
+    """Хранит скомпилированные шаблоны на диске, общими для воркеров и перезапусков
+
+    Запись в кэше привязана к хэшу исходника, так что измененный шаблон
+    просто компилируется заново. Включать до первой загрузки шаблонов.
+    Без directory Jinja сама создает каталог пользователя с правами 0700 и
+    проверяет его владельца, чтобы чужой байткод не попал в процесс.
+    """
+    if directory is None:
+        env.bytecode_cache = FileSystemBytecodeCache()
+    else:
+        env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def warm_up(env):
+    """Загружает все шаблоны при старте, чтобы первый запрос не ждал компиляции"""
+    started = time.perf_counter()
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    print(f"Шаблоны загружены: {len(names)} за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+
+def coalesce(pieces, chunk_size: int = 16 * 1024, flush_interval: float = 0.05):
+    """Склеивает мелкие куски вывода шаблона в порции для отправки
+
+    Порция уходит, когда набралось chunk_size символов или с прошлой отправки
+    прошло flush_interval секунд: если рендеринг ждет базу, уже готовый HTML
+    не задерживается.
+    """
+    buffer = []
+    size = 0
+    flushed_at = time.monotonic()
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size or time.monotonic() - flushed_at >= flush_interval:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+            flushed_at = time.monotonic()
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+class StreamingTemplateResponse(StreamingResponse):
+    """Ответ, который отправляет страницу по мере рендеринга через Template.generate()
+
+    Шапка страницы уходит клиенту до того, как закончится цикл по заметкам.
+    Генератор синхронный, Starlette выполняет его в пуле потоков, поэтому
+    ленивые запросы к базе внутри шаблона не блокируют цикл событий. Статус
+    200 отправляется до рендеринга: ошибка в середине шаблона оборвет ответ.
+    """
+
+    media_type = 'text/html'
+
+    def __init__(self, templates, name: str, context: dict, status_code: int = 200,
+                 headers: dict = None, chunk_size: int = 16 * 1024):
+        self.template = templates.get_template(name)
+        self.context = context
+        pieces = self.template.generate(context)
+        super().__init__(coalesce(pieces, chunk_size), status_code=status_code,
+                         headers=headers, media_type='text/html; charset=utf-8')
@@ -0,0 +1,210 @@
+# test_admission.py
+import asyncio
+import json
+
+from admission import AdmissionController, AdmissionMiddleware, RouteClass
+
+
+def make_controller(total=10, **classes):
+    route_classes = [RouteClass(name, **options) for name, options in classes.items()]
+    return AdmissionController(route_classes, [], default=route_classes[0].name, total=total)
+
+
+def test_classify_uses_first_matching_route():
+    controller = AdmissionController(
+        [RouteClass('pages', 4), RouteClass('writes', 2)],
+        [(None, r'/static/.*', None), ({'POST'}, r'/notes/\d+', 'writes'), (None, r'/notes/.*', 'pages')],
+        default='pages',
+    )
+    assert controller.classify('GET', '/static/style.css') is None
+    assert controller.classify('POST', '/notes/5').name == 'writes'
+    assert controller.classify('GET', '/notes/5').name == 'pages'
+    assert controller.classify('GET', '/other').name == 'pages'
+
+
+def test_admits_up_to_limit_then_rejects_without_queue():
+    async def scenario():
+        controller = make_controller(pages={'limit': 2})
+        pages = controller.classes['pages']
+        assert await controller.acquire(pages)
+        assert await controller.acquire(pages)
+        assert not await controller.acquire(pages)
+        assert pages.rejected == 1
+        controller.release(pages)
+        assert await controller.acquire(pages)
+        assert controller.active == 2
+
+    asyncio.run(scenario())
+
+
+def test_queued_request_times_out():
+    async def scenario():
+        controller = make_controller(pages={'limit': 1, 'queue': 1, 'max_wait': 0.05})
+        pages = controller.classes['pages']
+        assert await controller.acquire(pages)
+        assert not await controller.acquire(pages)
+        assert pages.timed_out == 1
+        assert pages.waiting == 0
+
+        # Снятый по таймауту запрос не получает освободившееся место
+        controller.release(pages)
+        assert pages.active == 0
+        assert controller.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_is_bounded():
+    async def scenario():
+        controller = make_controller(pages={'limit': 1, 'queue': 1, 'max_wait': 1.0})
+        pages = controller.classes['pages']
+        assert await controller.acquire(pages)
+        waiter = asyncio.create_task(controller.acquire(pages))
+        await asyncio.sleep(0)
+        assert pages.waiting == 1
+        assert not await controller.acquire(pages)
+        assert pages.rejected == 1
+
+        controller.release(pages)
+        assert await waiter
+        assert pages.active == 1
+        assert pages.max_waiting == 1
+
+    asyncio.run(scenario())
+
+
+def test_freed_slot_goes_to_highest_priority():
+    async def scenario():
+        controller = make_controller(
+            total=1,
+            background={'limit': 5, 'queue': 5, 'priority': 2, 'max_wait': 1.0},
+            interactive={'limit': 5, 'queue': 5, 'priority': 0, 'max_wait': 1.0},
+        )
+        background = controller.classes['background']
+        interactive = controller.classes['interactive']
+        assert await controller.acquire(background)
+
+        order = []
+
+        async def wait(route_class):
+            assert await controller.acquire(route_class)
+            order.append(route_class.name)
+
+        # Фоновый запрос встал в очередь раньше, но у интерактивного приоритет выше
+        low = asyncio.create_task(wait(background))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(wait(interactive))
+        await asyncio.sleep(0)
+
+        controller.release(background)
+        # Ожидающий просыпается через wait_for и shield - даем циклу несколько итераций
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert order == ['interactive']
+
+        controller.release(interactive)
+        await asyncio.gather(low, high)
+        assert order == ['interactive', 'background']
+
+    asyncio.run(scenario())
+
+
+def test_class_at_its_limit_does_not_block_other_classes():
+    async def scenario():
+        controller = make_controller(
+            total=2,
+            reports={'limit': 1, 'queue': 5, 'priority': 0, 'max_wait': 1.0},
+            pages={'limit': 5, 'queue': 5, 'priority': 1, 'max_wait': 1.0},
+        )
+        reports = controller.classes['reports']
+        pages = controller.classes['pages']
+        assert await controller.acquire(reports)
+        assert await controller.acquire(pages)
+
+        blocked = asyncio.create_task(controller.acquire(reports))
+        waiting = asyncio.create_task(controller.acquire(pages))
+        await asyncio.sleep(0)
+
+        # Место освободил pages: reports уперся в свой лимит, место получает pages
+        controller.release(pages)
+        assert await waiting
+        assert not blocked.done()
+        assert reports.waiting == 1
+
+        controller.release(reports)
+        assert await blocked
+
+    asyncio.run(scenario())
+
+
+def test_unshared_class_ignores_total_limit():
+    async def scenario():
+        controller = make_controller(total=1, pages={'limit': 1}, events={'limit': 3, 'shared': False})
+        assert await controller.acquire(controller.classes['pages'])
+        assert await controller.acquire(controller.classes['events'])
+        assert controller.active == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        controller = make_controller(pages={'limit': 1, 'queue': 2, 'max_wait': 1.0})
+        pages = controller.classes['pages']
+        assert await controller.acquire(pages)
+        waiter = asyncio.create_task(controller.acquire(pages))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert pages.waiting == 0
+
+        controller.release(pages)
+        assert pages.active == 0
+        assert controller.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_middleware_rejects_with_retry_after():
+    async def scenario():
+        controller = make_controller(pages={'limit': 1})
+        pages = controller.classes['pages']
+        pages.record_service(2.5)
+        assert await controller.acquire(pages)
+
+        async def app(scope, receive, send):
+            raise AssertionError('запрос не должен дойти до приложения')
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        middleware = AdmissionMiddleware(app, controller)
+        await middleware({'type': 'http', 'method': 'GET', 'path': '/home'}, None, send)
+
+        start, body = sent
+        headers = dict(start['headers'])
+        assert start['status'] == 503
+        assert headers[b'retry-after'] == b'3'
+        assert 'detail' in json.loads(body['body'])
+
+    asyncio.run(scenario())
+
+
+def test_middleware_releases_slot_after_error():
+    async def scenario():
+        controller = make_controller(pages={'limit': 1})
+
+        async def app(scope, receive, send):
+            raise RuntimeError('сбой обработчика')
+
+        middleware = AdmissionMiddleware(app, controller)
+        try:
+            await middleware({'type': 'http', 'method': 'GET', 'path': '/home'}, None, None)
+        except RuntimeError:
+            pass
+        assert controller.classes['pages'].active == 0
+        assert controller.active == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,216 @@
+# test_database.py
+import threading
+import time
+
+import pytest
+from mysql.connector import errorcode, errors
+
+import database
+from database import CircuitBreaker, Database, DatabaseUnavailable
+
+
+def test_breaker_stays_closed_below_threshold():
+    breaker = CircuitBreaker(failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_attempt()
+
+
+def test_breaker_opens_at_threshold_and_rejects_attempts():
+    breaker = CircuitBreaker(failure_threshold=2, base_delay=10, max_delay=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(DatabaseUnavailable) as error:
+        breaker.before_attempt()
+    assert 0 < error.value.retry_after <= 10
+
+
+def test_breaker_allows_single_trial_after_delay():
+    breaker = CircuitBreaker(failure_threshold=1, base_delay=0.01, max_delay=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+
+    breaker.before_attempt()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Пока идет пробное подключение, остальные получают отказ
+    with pytest.raises(DatabaseUnavailable):
+        breaker.before_attempt()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_attempt()
+
+
+def test_failed_trial_reopens_with_longer_delay():
+    breaker = CircuitBreaker(failure_threshold=1, base_delay=0.02, max_delay=60)
+    breaker.record_failure()
+    first = breaker.retry_after()
+    time.sleep(first + 0.01)
+
+    breaker.before_attempt()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    # Задержка удваивается: первая была не больше 0.02 с, вторая - не меньше
+    assert breaker.retry_after() >= 0.02 >= first
+
+
+class FakeConnection:
+    def __init__(self):
+        self.lost = False
+        self.log = []
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        self._check()
+        self.log.append('COMMIT')
+
+    def rollback(self):
+        self.log.append('ROLLBACK')
+
+    def ping(self, reconnect=False):
+        self._check()
+
+    def close(self):
+        pass
+
+    def _check(self):
+        if self.lost:
+            raise errors.OperationalError(msg='Lost connection', errno=errorcode.CR_SERVER_LOST)
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        self.connection._check()
+        self.connection.log.append(sql)
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Database, подключающаяся к FakeConnection; connects - все открытые соединения"""
+    connects = []
+
+    def connect(self):
+        time.sleep(0.02)
+        connection = FakeConnection()
+        connects.append(connection)
+        return connection
+
+    monkeypatch.setattr(Database, '_connect', connect)
+    db = Database()
+    db.connects = connects
+    return db
+
+
+def test_commit_fails_after_another_thread_reconnected(fake_db):
+    writer = fake_db.get_connection()
+    writer.cursor().execute("INSERT INTO notes VALUES (1)")
+    lost = fake_db.connection
+    lost.lost = True
+
+    # Другой запрос замечает потерю, третий переподключается
+    other = fake_db.get_connection().cursor()
+    with pytest.raises(errors.OperationalError):
+        other.execute("UPDATE users SET note_count = 0")
+    fake_db.get_connection()
+    assert fake_db.connection is not lost
+
+    with pytest.raises(errors.OperationalError) as error:
+        writer.commit()
+    assert error.value.errno == errorcode.CR_SERVER_LOST
+    assert 'COMMIT' not in fake_db.connection.log
+
+    # Откат не трогает новое соединение
+    writer.rollback()
+    assert fake_db.connection.log == []
+
+
+def test_read_is_retried_on_new_connection(fake_db):
+    reader = fake_db.get_connection().cursor()
+    fake_db.connection.lost = True
+    reader.execute("SELECT 1")
+    assert reader.fetchall() == [(1,)]
+    assert len(fake_db.connects) == 2
+
+
+def test_write_is_not_retried(fake_db):
+    connection = fake_db.get_connection()
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO notes VALUES (1)")
+    fake_db.connection.lost = True
+    with pytest.raises(errors.OperationalError):
+        cursor.execute("SELECT 1")
+    assert len(fake_db.connects) == 1
+
+
+def test_error_on_replaced_connection_keeps_new_one(fake_db):
+    old = fake_db.get_connection()
+    fake_db.connection.lost = True
+    fake_db.mark_lost(old.raw)
+    fake_db.get_connection()
+    current = fake_db.connection
+
+    fake_db.mark_lost(old.raw)
+    assert fake_db.connection is current
+
+
+def test_concurrent_reconnects_open_one_connection(fake_db):
+    threads = [threading.Thread(target=fake_db.get_connection) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fake_db.connects) == 1
+
+
+def test_waiters_do_not_repeat_failed_connect(monkeypatch):
+    attempts = []
+
+    def refuse(self):
+        time.sleep(0.05)
+        attempts.append(1)
+        raise errors.InterfaceError(msg='Connection refused', errno=errorcode.CR_CONN_HOST_ERROR)
+
+    monkeypatch.setattr(Database, '_connect', refuse)
+    db = Database()
+    results = []
+
+    def connect():
+        try:
+            db.get_connection()
+        except DatabaseUnavailable:
+            results.append('unavailable')
+
+    threads = [threading.Thread(target=connect) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['unavailable'] * 20
+    # Одна попытка на группу ожидавших, а не по попытке на поток
+    assert len(attempts) < 5
+
+
+def test_statement_cache_evicts_least_recently_used():
+    cache = database.StatementCache(FakeConnection(), capacity=2)
+    first = cache.get("SELECT 1")
+    cache.get("SELECT 2")
+    assert cache.get("SELECT 1") is first
+    cache.get("SELECT 3")
+    # Вытеснен давно не использованный SELECT 2, а не первый запрос
+    assert cache.get("SELECT 1") is first
+    assert (cache.hits, cache.misses) == (2, 3)
+    cache.get("SELECT 2")
+    assert cache.misses == 4
@@ -0,0 +1,63 @@
+# test_deltas.py
+import random
+
+import pytest
+
+from deltas import DeltaError, apply_ops, diff_ops
+
+
+def test_apply_ops_replaces_inserts_and_deletes():
+    assert apply_ops('hello world', [(0, 5, 'goodbye')]) == 'goodbye world'
+    assert apply_ops('ac', [(1, 1, 'b')]) == 'abc'
+    assert apply_ops('abc', [(1, 2, '')]) == 'ac'
+    assert apply_ops('abc', []) == 'abc'
+
+
+def test_apply_ops_positions_refer_to_original_text():
+    # Правки в любом порядке применяются по позициям исходного текста
+    assert apply_ops('0123456789', [(8, 9, 'X'), (1, 2, 'long')]) == '0long234567X9'
+
+
+def test_apply_ops_counts_code_points():
+    assert apply_ops('😀a\nb', [(3, 4, 'B')]) == '😀a\nB'
+
+
+@pytest.mark.parametrize('ops', [
+    [(2, 5, 'x'), (4, 6, 'y')],  # пересекаются
+    [(3, 2, 'x')],               # конец раньше начала
+    [(0, 11, 'x')],              # за концом текста
+    [(-1, 0, 'x')],
+])
+def test_apply_ops_rejects_invalid_ranges(ops):
+    with pytest.raises(DeltaError):
+        apply_ops('0123456789', ops)
+
+
+def test_diff_ops_of_equal_texts_is_empty():
+    assert diff_ops('same', 'same') == []
+    assert diff_ops('', '') == []
+
+
+def test_diff_ops_is_single_minimal_range():
+    assert diff_ops('hello world', 'hello there world') == [(6, 6, 'there ')]
+    assert diff_ops('aaaa', 'aa') == [(2, 4, '')]
+
+
+def test_diff_ops_round_trip():
+    rng = random.Random(7)
+    alphabet = 'ab\n😀ж'
+    for _ in range(300):
+        old = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        start = rng.randint(0, len(old))
+        end = rng.randint(start, len(old))
+        new = old[:start] + ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 5))) + old[end:]
+        assert apply_ops(old, diff_ops(old, new)) == new
+
+
+def test_diff_ops_round_trip_across_compare_blocks():
+    # Длиннее блока сравнения (1024), правка на границе блоков
+    old = 'x' * 5000
+    new = old[:2048] + 'y' + old[2049:]
+    ops = diff_ops(old, new)
+    assert ops == [(2048, 2049, 'y')]
+    assert apply_ops(old, ops) == new
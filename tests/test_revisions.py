@@ -0,0 +1,186 @@
+# test_revisions.py
+import re
+
+import pytest
+
+import revisions
+from deltas import apply_ops
+from revisions import SNAPSHOT_INTERVAL, load_revision, prune_note, record_change
+
+
+class RevisionsCursor:
+    """Таблица note_revisions в памяти: понимает только запросы из revisions.py"""
+
+    def __init__(self):
+        self.rows = {}
+        self.rowcount = 0
+        self._result = []
+
+    def execute(self, sql, params=()):
+        sql = re.sub(r'\s+', ' ', sql).strip()
+        rows = self.rows
+        if sql.startswith('INSERT INTO note_revisions'):
+            note_id, version, kind, title, body = params
+            assert (note_id, version) not in rows, 'дубликат версии'
+            rows[(note_id, version)] = (kind, title, body)
+            self._result = []
+        elif sql.startswith('SELECT MAX(version), MAX(CASE'):
+            versions = self._versions(params[0])
+            snapshots = [v for v in versions if rows[(params[0], v)][0] != 'delta']
+            self._result = [(max(versions, default=None), max(snapshots, default=None))]
+        elif sql.startswith('SELECT version, kind, title, body'):
+            note_id, version = params[0], params[1]
+            snapshots = [v for v in self._versions(note_id) if v <= version and rows[(note_id, v)][0] != 'delta']
+            if not snapshots:
+                self._result = []
+            else:
+                self._result = [(v,) + rows[(note_id, v)] for v in self._versions(note_id)
+                                if max(snapshots) <= v <= version]
+        elif sql.startswith('SELECT MAX(version) FROM note_revisions'):
+            self._result = [(max(self._versions(params[0]), default=None),)]
+        elif sql.startswith('SELECT kind FROM note_revisions'):
+            row = rows.get(tuple(params))
+            self._result = [(row[0],)] if row else []
+        elif sql.startswith('UPDATE note_revisions SET kind'):
+            kind, body, note_id, version = params
+            rows[(note_id, version)] = (kind, rows[(note_id, version)][1], body)
+        elif sql.startswith('DELETE FROM note_revisions'):
+            note_id, version = params
+            old = [v for v in self._versions(note_id) if v < version]
+            for v in old:
+                del rows[(note_id, v)]
+            self.rowcount = len(old)
+        else:
+            raise AssertionError(f'неожиданный запрос: {sql}')
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return list(self._result)
+
+    def _versions(self, note_id):
+        return sorted(v for n, v in self.rows if n == note_id)
+
+    def kinds(self, note_id):
+        return {v: self.rows[(note_id, v)][0] for v in self._versions(note_id)}
+
+
+def edit_many(cursor, note_id, text, count, start_version=1):
+    """Делает count правок подряд, возвращает {версия: текст}"""
+    texts = {start_version: text}
+    version = start_version
+    for i in range(count):
+        new = text[:i % (len(text) + 1)] + f'[{i}]' + text[i % (len(text) + 1):]
+        record_change(cursor, note_id, version, f't{version}', text, f't{version + 1}', new)
+        version += 1
+        text = texts[version] = new
+    return texts
+
+
+def test_first_edit_snapshots_original_text():
+    cursor = RevisionsCursor()
+    old = 'первый текст заметки\n' * 5
+    new = old + 'добавка'
+    record_change(cursor, 1, 1, 'old', old, 'new', new)
+    assert cursor.kinds(1) == {1: 'text', 2: 'delta'}
+    assert load_revision(cursor, 1, 1) == ('old', old)
+    assert load_revision(cursor, 1, 2) == ('new', new)
+
+
+def test_every_version_is_restored_across_snapshots():
+    cursor = RevisionsCursor()
+    texts = edit_many(cursor, 1, 'строка\nвторая строка\n' * 3, SNAPSHOT_INTERVAL * 3)
+    for version, text in texts.items():
+        assert load_revision(cursor, 1, version) == (f't{version}', text)
+
+    # Между снимками не больше SNAPSHOT_INTERVAL - 1 правок
+    snapshots = [v for v, kind in cursor.kinds(1).items() if kind != 'delta']
+    assert all(b - a <= SNAPSHOT_INTERVAL for a, b in zip(snapshots, snapshots[1:]))
+    assert max(texts) - snapshots[-1] < SNAPSHOT_INTERVAL
+
+
+def test_large_texts_are_stored_packed():
+    cursor = RevisionsCursor()
+    text = 'большая заметка ' * 1000
+    record_change(cursor, 1, 1, 't', text, 't', text + '!')
+    assert cursor.kinds(1)[1] == 'packed'
+    assert load_revision(cursor, 1, 1) == ('t', text)
+    assert load_revision(cursor, 1, 2) == ('t', text + '!')
+
+
+def test_large_edit_is_stored_as_snapshot():
+    cursor = RevisionsCursor()
+    record_change(cursor, 1, 1, 't', 'abc', 't', 'совсем другой текст')
+    assert cursor.kinds(1)[2] != 'delta'
+
+
+def test_known_ops_are_stored_as_given():
+    cursor = RevisionsCursor()
+    old = 'a' * 100
+    ops = [(10, 10, 'X')]
+    record_change(cursor, 1, 1, 't', old, 't', apply_ops(old, ops), ops)
+    assert load_revision(cursor, 1, 2) == ('t', apply_ops(old, ops))
+
+
+def test_gap_in_history_appends_snapshot_and_keeps_old_versions():
+    cursor = RevisionsCursor()
+    texts = edit_many(cursor, 1, 'начало заметки ' * 10, 3)
+    # Заметка менялась без записи истории: версии 5..7 пропущены
+    seventh = 'текст седьмой версии ' * 10
+    record_change(cursor, 1, 7, 't7', seventh, 't8', seventh + '!')
+    assert cursor.kinds(1) == {1: 'text', 2: 'delta', 3: 'delta', 4: 'delta', 7: 'text', 8: 'delta'}
+    for version, text in texts.items():
+        assert load_revision(cursor, 1, version) == (f't{version}', text)
+    assert load_revision(cursor, 1, 7) == ('t7', seventh)
+    assert load_revision(cursor, 1, 8) == ('t8', seventh + '!')
+    assert load_revision(cursor, 1, 5) is None
+
+
+def test_load_missing_revision_returns_none():
+    cursor = RevisionsCursor()
+    assert load_revision(cursor, 1, 1) is None
+    edit_many(cursor, 1, 'текст', 2)
+    assert load_revision(cursor, 1, 10) is None
+    assert load_revision(cursor, 2, 1) is None
+
+
+def test_prune_keeps_last_versions_and_turns_oldest_into_snapshot():
+    cursor = RevisionsCursor()
+    texts = edit_many(cursor, 1, 'заметка для очистки ' * 10, 30)
+    last = max(texts)
+    keep = 7
+    oldest = last - keep + 1
+    assert cursor.kinds(1)[oldest] == 'delta'
+
+    deleted = prune_note(cursor, 1, keep=keep)
+
+    assert deleted == oldest - 1
+    assert sorted(cursor.kinds(1)) == list(range(oldest, last + 1))
+    assert cursor.kinds(1)[oldest] != 'delta'
+    for version in range(oldest, last + 1):
+        assert load_revision(cursor, 1, version) == (f't{version}', texts[version])
+
+
+def test_prune_without_enough_history_deletes_nothing():
+    cursor = RevisionsCursor()
+    edit_many(cursor, 1, 'коротко', 3)
+    assert prune_note(cursor, 1, keep=10) == 0
+    assert len(cursor.kinds(1)) == 4
+    assert prune_note(cursor, 2) == 0
+
+
+def test_prune_leaves_history_when_oldest_kept_version_cannot_be_restored(monkeypatch):
+    cursor = RevisionsCursor()
+    edit_many(cursor, 1, 'текст заметки ' * 10, 10)
+    assert cursor.kinds(1)[7] == 'delta'
+    monkeypatch.setattr(revisions, 'load_revision', lambda *args: None)
+    assert prune_note(cursor, 1, keep=5) == 0
+    assert len(cursor.kinds(1)) == 11
+
+
+@pytest.mark.parametrize('old,new', [('', 'новое'), ('старое', ''), ('x\r\ny', 'x\ny')])
+def test_delta_chain_handles_edge_texts(old, new):
+    cursor = RevisionsCursor()
+    record_change(cursor, 1, 1, 't', 'база ' * 20 + old, 't', 'база ' * 20 + new)
+    assert load_revision(cursor, 1, 2) == ('t', 'база ' * 20 + new)
@@ -0,0 +1,244 @@
+# typeahead.py
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from mysql.connector import Error
+
+from cache import TTLCache
+from database import db
+
+
+class TitleIndex:
+    """Отсортированный список названий заметок одного пользователя
+
+    Поиск по префиксу - двоичный поиск и проход по соседним элементам.
+    Ключ - название в casefold, поэтому поиск не зависит от регистра.
+    """
+
+    __slots__ = ('keys', 'ids', 'titles', 'by_id', 'size', 'built_at')
+
+    def __init__(self, rows):
+        entries = sorted((self._key(title), note_id, title) for note_id, title in rows)
+        self.keys = [entry[0] for entry in entries]
+        self.ids = [entry[1] for entry in entries]
+        self.titles = [entry[2] for entry in entries]
+        self.by_id = dict(zip(self.ids, self.keys))
+        self.size = sum(self._entry_size(key, title) for key, _, title in entries)
+        self.built_at = time.monotonic()
+
+    @staticmethod
+    def _key(title: str) -> str:
+        key = title.casefold()
+        # Для названий без заглавных букв ключ и название - одна и та же строка
+        return title if key == title else key
+
+    @staticmethod
+    def _entry_size(key: str, title: str) -> int:
+        # Три ссылки в списках, id, запись в словаре by_id и сами строки
+        size = 3 * 8 + 28 + 56 + sys.getsizeof(title)
+        if key is not title:
+            size += sys.getsizeof(key)
+        return size
+
+    def search(self, prefix: str, limit: int):
+        prefix = prefix.casefold()
+        position = bisect_left(self.keys, prefix)
+        end = min(position + limit, len(self.keys))
+        result = []
+        while position < end and self.keys[position].startswith(prefix):
+            result.append({'id': self.ids[position], 'title': self.titles[position]})
+            position += 1
+        return result
+
+    def add(self, note_id: int, title: str):
+        self.remove(note_id)
+        key = self._key(title)
+        position = bisect_left(self.keys, key)
+        # Среди одинаковых названий держим порядок по id, как при построении
+        while position < len(self.keys) and self.keys[position] == key and self.ids[position] < note_id:
+            position += 1
+        self.keys.insert(position, key)
+        self.ids.insert(position, note_id)
+        self.titles.insert(position, title)
+        self.by_id[note_id] = key
+        self.size += self._entry_size(key, title)
+
+    def remove(self, note_id: int):
+        key = self.by_id.pop(note_id, None)
+        if key is None:
+            return
+        position = bisect_left(self.keys, key)
+        while self.ids[position] != note_id:
+            position += 1
+        self.size -= self._entry_size(self.keys[position], self.titles[position])
+        del self.keys[position], self.ids[position], self.titles[position]
+
+
+class TypeaheadIndex:
+    """Индексы названий по пользователям, строятся лениво и вытесняются по LRU
+
+    loader(user_email) возвращает пары (id, title) всех заметок пользователя
+    или None, если загрузить их не удалось.
+    Если индекс пользователя больше max_user_bytes, он не хранится, и поиск
+    уходит в fallback(user_email, prefix, limit). Индекс живет в процессе;
+    изменения из других воркеров он увидит после перестройки через max_age.
+    """
+
+    def __init__(self, loader, fallback=None, max_bytes: int = 128 * 1024 * 1024,
+                 max_user_bytes: int = 32 * 1024 * 1024, max_users: int = 1000,
+                 idle_ttl: float = 600.0, max_age: float = 300.0):
+        self.loader = loader
+        self.fallback = fallback
+        self.max_bytes = max_bytes
+        self.max_user_bytes = max_user_bytes
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.max_age = max_age
+        self.size = 0
+        # user_email -> (индекс, время последнего обращения), от давних к свежим
+        self._indexes = OrderedDict()
+        # Пользователи, чьи заметки изменились во время построения индекса
+        self._building = {}
+        # Пользователи со слишком большим индексом, чтобы не строить его на каждый запрос
+        self._oversized = TTLCache(max_age, max_users)
+        self._lock = threading.Lock()
+
+    def search(self, user_email: str, prefix: str, limit: int = 10):
+        index = self._get(user_email)
+        if index is None:
+            return self.fallback(user_email, prefix, limit) if self.fallback else []
+        with self._lock:
+            return index.search(prefix, limit)
+
+    def note_saved(self, user_email: str, note_id: int, title: str):
+        self._update(user_email, lambda index: index.add(note_id, title))
+
+    def note_deleted(self, user_email: str, note_id: int):
+        self._update(user_email, lambda index: index.remove(note_id))
+
+    def forget(self, user_email: str):
+        with self._lock:
+            self._drop(user_email)
+            if user_email in self._building:
+                self._building[user_email] = True
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self.size = 0
+
+    def _update(self, user_email: str, change):
+        # Изменение применяется только к уже построенному индексу
+        with self._lock:
+            if user_email in self._building:
+                self._building[user_email] = True
+            item = self._indexes.get(user_email)
+            if item is None:
+                return
+            index = item[0]
+            self.size -= index.size
+            change(index)
+            self.size += index.size
+            if index.size > self.max_user_bytes:
+                self._drop(user_email)
+                self._oversized.set(user_email, True)
+            else:
+                self._evict()
+
+    def _get(self, user_email: str):
+        if self._oversized.get(user_email):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            item = self._indexes.get(user_email)
+            if item is not None and now - item[0].built_at < self.max_age:
+                self._indexes[user_email] = (item[0], now)
+                self._indexes.move_to_end(user_email)
+                return item[0]
+            self._building[user_email] = False
+
+        try:
+            rows = self.loader(user_email)
+            index = TitleIndex(rows) if rows is not None else None
+        except Exception:
+            with self._lock:
+                self._building.pop(user_email, None)
+            raise
+
+        with self._lock:
+            changed = self._building.pop(user_email, False)
+            if index is None:
+                return None
+            if index.size > self.max_user_bytes:
+                self._oversized.set(user_email, True)
+                return None
+            if changed:
+                # Заметки менялись во время загрузки: ответим по этому индексу, но не сохраним его
+                return index
+            self._drop(user_email)
+            self._indexes[user_email] = (index, now)
+            self.size += index.size
+            self._evict()
+            return index
+
+    def _drop(self, user_email: str):
+        item = self._indexes.pop(user_email, None)
+        if item is not None:
+            self.size -= item[0].size
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._indexes:
+            user_email, (index, used_at) = next(iter(self._indexes.items()))
+            if (self.size > self.max_bytes or len(self._indexes) > self.max_users
+                    or now - used_at > self.idle_ttl):
+                self._drop(user_email)
+            else:
+                break
+
+
+def load_note_titles(user_email: str):
+    """Все пары (id, title) заметок пользователя для построения индекса"""
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT n.id, n.title FROM notes n
+            JOIN users u ON n.user_id = u.id
+            WHERE u.email = %s
+        """, (user_email,))
+        return cursor.fetchall()
+    except Error as e:
+        print(f"Ошибка при загрузке названий заметок: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+def search_note_titles(user_email: str, prefix: str, limit: int):
+    """Поиск по префиксу в базе для пользователей, чей индекс не помещается в память"""
+    connection = db.get_connection()
+
+    try:
+        cursor = connection.cursor()
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        cursor.execute("""
+            SELECT n.id, n.title FROM notes n
+            JOIN users u ON n.user_id = u.id
+            WHERE u.email = %s AND n.title LIKE %s
+            ORDER BY n.title, n.id
+            LIMIT %s
+        """, (user_email, pattern, limit))
+        return [{'id': note_id, 'title': title} for note_id, title in cursor.fetchall()]
+    except Error as e:
+        print(f"Ошибка при поиске заметок: {e}")
+        return []
+    finally:
+        cursor.close()
+
+
+title_index = TypeaheadIndex(load_note_titles, search_note_titles)